@@ -1,5 +1,7 @@
-﻿import os
+﻿import operator
+import os
 import secrets
+import select
 import shutil
 import subprocess
 import tempfile
@@ -7,17 +9,25 @@ import threading
 import time
 import zipfile
 import re
-from dataclasses import asdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Any, Optional, Tuple
 
-from fastapi import Depends, FastAPI, File, HTTPException, Query, UploadFile
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+import orjson
+from fastapi import BackgroundTasks, Depends, FastAPI, File, HTTPException, Query, UploadFile
 from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
 
-from job_queue import JobQueue
+from job_queue import JobQueue, copy_fileobj
 from mqtt_client import PrinterManager, load_config
 from slicer import auto_slice, load_slicer_config
 
@@ -28,13 +38,41 @@ security = HTTPBasic(auto_error=False)
 DASH_USER = os.getenv("DASH_USER")
 DASH_PASS = os.getenv("DASH_PASS")
 CONNECT_ON_START = os.getenv("CONNECT_ON_START", "1") != "0"
+QUEUE_FSYNC = os.getenv("QUEUE_FSYNC", "0") == "1"
 BASE_DIR = Path(__file__).resolve().parent
 
 READY_EXTS = (".gcode", ".gcode.3mf")
 # Files that *may* be slicable if an external slicer CLI is configured.
 # Keep this list conservative; "auto-slice" is best-effort and depends on the slicer.
 SLICABLE_EXTS = (".stl", ".obj", ".3mf")
-PLATE_GCODE_RE = re.compile(r"^Metadata[\\/]plate_\d+\.gcode$", re.IGNORECASE)
+PLATE_GCODE_PREFIXES = ("metadata/plate_", "metadata\\plate_")
+# Local file header signature + 22 fixed bytes, then the 2-byte name length,
+# the 2-byte extra length and the entry name itself.
+PLATE_GCODE_HEADER_RE = re.compile(
+    rb"PK\x03\x04[\s\S]{22}([\s\S]{2})[\s\S]{2}(Metadata[\\/]plate_\d+\.gcode)", re.IGNORECASE
+)
+PRESLICED_PROBE_BYTES = 64 * 1024
+# ffmpeg stdout is an unbuffered pipe, so read() returns whatever is ready up
+# to this size; a large cap lets one syscall/yield cover several frames.
+MJPEG_READ_CHUNK = 128 * 1024
+# Linux only: grow the ffmpeg stdout pipe (default 64 KiB) so large frames
+# don't stall ffmpeg between our reads.
+MJPEG_PIPE_SIZE = 1024 * 1024
+# Caps the parser buffer when a frame's EOI marker never arrives.
+MJPEG_MAX_FRAME_BYTES = 2_000_000
+# Resolved once; camera endpoints would otherwise walk $PATH on every request.
+FFMPEG_BIN = shutil.which("ffmpeg")
+FFPROBE_BIN = shutil.which("ffprobe")
+# /api/camera/snapshot reuses a live stream's frame if it is at most this old.
+SNAPSHOT_MAX_AGE_SEC = 1.0
+# After a snapshot, keep that camera's ffmpeg running this long so UI polling
+# is served from the warm stream instead of a fresh ffmpeg per request.
+SNAPSHOT_WARM_SEC = 15.0
+# How long a new stream waits for ffmpeg's first output (or early exit).
+MJPEG_STARTUP_WAIT_SEC = 0.5
+# After a failed codec probe, skip probing that camera (use the re-encode
+# path) for this long rather than blocking every stream open on ffprobe.
+CODEC_PROBE_RETRY_SEC = 60.0
 
 
 def require_auth(credentials: Optional[HTTPBasicCredentials] = Depends(security)) -> None:
@@ -52,7 +90,14 @@ def require_auth(credentials: Optional[HTTPBasicCredentials] = Depends(security)
         )
 
 
-app = FastAPI()
+class ORJSONResponse(JSONResponse):
+    # Status/diag payloads (MQTT dumps, dispatcher summaries) are large and
+    # polled constantly; orjson encodes them several times faster than stdlib json.
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+app = FastAPI(default_response_class=ORJSONResponse)
 app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
 
 CONFIG_PATH = BASE_DIR / "config.json"
@@ -61,11 +106,32 @@ if not CONFIG_PATH.exists():
 
 config = load_config(str(CONFIG_PATH))
 manager = PrinterManager(config)
-queue = JobQueue(str(BASE_DIR / "jobs"))
+queue = JobQueue(str(BASE_DIR / "jobs"), durable=QUEUE_FSYNC)
 slicer_config = load_slicer_config(str(CONFIG_PATH))
+# Broadcast actions are independent, network-bound MQTT round-trips; run them
+# concurrently so fleet actions take ~one printer's latency instead of N.
+_BROADCAST_POOL = ThreadPoolExecutor(
+    max_workers=min(32, len(config.printers) + 4), thread_name_prefix="broadcast"
+)
 
 IDLE_STATE_TOKENS = ("idle", "ready", "finish", "completed", "standby")
 BUSY_STATE_TOKENS = ("print", "running", "busy", "pause", "prepar", "calib", "heating", "homing")
+_BUSY_STATE_RE = re.compile("|".join(map(re.escape, BUSY_STATE_TOKENS)))
+_IDLE_STATE_RE = re.compile("|".join(map(re.escape, IDLE_STATE_TOKENS)))
+# Exact gcode_state values reported by Bambu firmware (bambulabs_api GcodeState).
+_STATE_FAST = {
+    "idle": "idle",
+    "finish": "idle",
+    "prepare": "busy",
+    "running": "busy",
+    "pause": "busy",
+    "failed": "failed",
+    "unknown": "unknown",
+}
+# Normalized printer_state -> "busy" / "idle" / "failed" / "unknown". Firmware
+# only reports a handful of distinct states, so the scan runs once per string.
+_STATE_CLASS_CACHE: dict[str, str] = dict(_STATE_FAST)
+_STATE_CLASS_CACHE_MAX = 256
 
 
 def resolve_printer_id(printer_id: Optional[str]) -> str:
@@ -82,24 +148,42 @@ def get_service_or_404(printer_id: Optional[str]):
         raise HTTPException(status_code=404, detail=str(exc))
 
 
+@lru_cache(maxsize=128)
 def normalize_state(value: Optional[str]) -> str:
     if not value:
         return ""
     return str(value).lower()
 
 
+def _classify_state(state: str) -> str:
+    cls = _STATE_CLASS_CACHE.get(state)
+    if cls is not None:
+        return cls
+    if _BUSY_STATE_RE.search(state):
+        cls = "busy"
+    elif _IDLE_STATE_RE.search(state):
+        cls = "idle"
+    elif "failed" in state:
+        cls = "failed"
+    else:
+        cls = "unknown"
+    if len(_STATE_CLASS_CACHE) < _STATE_CLASS_CACHE_MAX:
+        _STATE_CLASS_CACHE[state] = cls
+    return cls
+
+
 def is_printer_available(status: dict) -> bool:
     if not status.get("connected"):
         return False
-    state = normalize_state(status.get("printer_state"))
-    if any(token in state for token in BUSY_STATE_TOKENS):
+    cls = _classify_state(normalize_state(status.get("printer_state")))
+    if cls == "busy":
         return False
-    if any(token in state for token in IDLE_STATE_TOKENS):
+    if cls == "idle":
         return True
     # Many Bambu firmwares report gcode_state=FAILED after a user stop/cancel,
     # while still being able to start the next job. Treat this as available
     # only when there are no non-zero error indicators.
-    if "failed" in state:
+    if cls == "failed":
         try:
             code = status.get("print_error_code")
             code_ok = int(code) == 0
@@ -121,8 +205,7 @@ def ensure_not_printing(printer_id: str) -> None:
     status = manager.get_status(printer_id)
     if not status.get("connected"):
         raise HTTPException(status_code=409, detail="Printer not connected")
-    state = normalize_state(status.get("printer_state"))
-    if any(token in state for token in BUSY_STATE_TOKENS):
+    if _classify_state(normalize_state(status.get("printer_state"))) == "busy":
         raise HTTPException(status_code=409, detail="Action blocked while printer is busy")
 
 
@@ -137,6 +220,23 @@ def is_slicable_file(filename: str) -> bool:
         return False
     return lower.endswith(SLICABLE_EXTS)
 
+def is_plate_gcode_name(name: str) -> bool:
+    # Equivalent to ^Metadata[\\/]plate_\d+\.gcode$ (case-insensitive) without
+    # running the regex engine for every archive member.
+    if len(name) < 22 or name[:9].lower() not in ("metadata/", "metadata\\"):
+        return False
+    lower = name.lower()
+    return lower.startswith(PLATE_GCODE_PREFIXES) and lower.endswith(".gcode") and lower[15:-6].isdigit()
+
+
+def has_plate_gcode_header(data: bytes) -> bool:
+    # The name-length field must cover exactly the matched name, so entries
+    # like Metadata/plate_1.gcode.md5 don't pass for plate G-code.
+    return any(
+        int.from_bytes(m.group(1), "little") == len(m.group(2)) for m in PLATE_GCODE_HEADER_RE.finditer(data)
+    )
+
+
 def is_presliced_3mf_upload(file: UploadFile) -> bool:
     """
     Detect "sliced 3MF" containers (same content as .gcode.3mf) by looking
@@ -150,9 +250,14 @@ def is_presliced_3mf_upload(file: UploadFile) -> bool:
         return False
     try:
         fileobj.seek(0)
+        # Sliced exports usually store plate_N.gcode early; probing the first
+        # local headers answers most uploads without parsing the archive.
+        if has_plate_gcode_header(fileobj.read(PRESLICED_PROBE_BYTES)):
+            return True
+        fileobj.seek(0)
         with zipfile.ZipFile(fileobj) as zf:
-            for name in zf.namelist():
-                if PLATE_GCODE_RE.match(name):
+            for info in zf.infolist():
+                if is_plate_gcode_name(info.filename):
                     return True
     except zipfile.BadZipFile:
         return False
@@ -186,7 +291,7 @@ def validate_upload_file(file: UploadFile) -> dict:
 def save_upload_to_path(file: UploadFile, path: str) -> None:
     file.file.seek(0)
     with open(path, "wb") as handle:
-        shutil.copyfileobj(file.file, handle)
+        copy_fileobj(file.file, handle)
 
 
 def slice_upload(file: UploadFile) -> Tuple[str, str, str]:
@@ -202,14 +307,49 @@ def slice_upload(file: UploadFile) -> Tuple[str, str, str]:
     return output_path, output_name, tmpdir
 
 
+def cleanup_tmpdir(tmpdir: str, background_tasks: Optional[BackgroundTasks] = None) -> None:
+    # Slicer workdirs can hold several large files; when a response is being
+    # returned, unlink them after it is sent. Background tasks never run for
+    # error responses, so those callers pass None and clean up inline.
+    if background_tasks is not None:
+        background_tasks.add_task(shutil.rmtree, tmpdir, ignore_errors=True)
+    else:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+# Fields reported per printer when nothing is available to dispatch to.
+# PrinterService status dicts always carry every key, so itemgetter is safe.
+_STATUS_REPORT_KEYS = (
+    "id",
+    "connected",
+    "printer_state",
+    "print_status",
+    "print_error_code",
+    "fail_reason",
+    "mc_print_error_code",
+)
+_get_status_report = operator.itemgetter(*_STATUS_REPORT_KEYS)
+
+
+@dataclass(frozen=True, slots=True)
+class DispatchSnapshot:
+    dispatched_at: Optional[float]
+    error: Optional[str]
+    result: Optional[dict]
+
+
 class Dispatcher:
     def __init__(self, interval_sec: float) -> None:
         self._interval_sec = interval_sec
         self._running = False
         self._thread: Optional[threading.Thread] = None
-        self._last_error: Optional[str] = None
-        self._last_dispatch_at: Optional[float] = None
-        self._last_result: Optional[dict] = None
+        # Replaced wholesale after every tick so readers on other threads see a
+        # consistent (time, error, result) triple from a single attribute load.
+        self._snapshot = DispatchSnapshot(dispatched_at=None, error=None, result=None)
+        # Set whenever something happens that could make a job dispatchable
+        # (new job, job finished, printer state change). The interval is only
+        # a fallback so missed notifications still get picked up.
+        self._wake = threading.Event()
 
     def start(self) -> None:
         self._running = True
@@ -218,17 +358,24 @@ class Dispatcher:
 
     def stop(self) -> None:
         self._running = False
+        self._wake.set()
+
+    def notify(self) -> None:
+        self._wake.set()
 
     def _loop(self) -> None:
         while self._running:
-            self._last_dispatch_at = time.time()
+            self._wake.clear()
+            dispatched_at = time.time()
             try:
-                self._last_result = self.dispatch_once()
-                self._last_error = None
+                result = self.dispatch_once()
+                error = None
             except Exception as exc:  # noqa: BLE001
                 # Never let the dispatcher thread die silently.
-                self._last_error = str(exc)
-            time.sleep(self._interval_sec)
+                result = self._snapshot.result
+                error = str(exc)
+            self._snapshot = DispatchSnapshot(dispatched_at=dispatched_at, error=error, result=result)
+            self._wake.wait(timeout=self._interval_sec)
 
     def dispatch_once(self) -> dict:
         summary = {
@@ -242,18 +389,23 @@ class Dispatcher:
 
         # If polling isn't running (or a printer dropped), attempt to connect
         # on-demand so jobs can still dispatch.
-        for pid, st in list(statuses.items()):
+        refreshed = False
+        for pid, st in statuses.items():
             needs_refresh = (not st.get("connected")) or (st.get("printer_state") is None)
             if not needs_refresh:
                 continue
             try:
                 manager.get_service(pid).test_connection(force=False)
+                refreshed = True
             except Exception:
                 pass
-        statuses = {item["id"]: item for item in manager.list_printers()}
+        if refreshed:
+            statuses = {item["id"]: item for item in manager.list_printers()}
+
+        by_status = queue.list_jobs_by_status("running", "queued")
 
         # Opportunistically update running jobs based on printer state.
-        for job in queue.list_jobs(status="running"):
+        for job in by_status["running"]:
             pid = job.get("assigned_printer_id")
             if not pid or pid not in statuses:
                 continue
@@ -278,7 +430,7 @@ class Dispatcher:
                     msg += " (" + ", ".join(details) + ")"
                 queue.mark_failed(job["id"], msg)
 
-        jobs = queue.list_jobs(status="queued")
+        jobs = by_status["queued"]
         if not jobs:
             return summary
         summary["queued"] = len(jobs)
@@ -289,15 +441,7 @@ class Dispatcher:
                 {
                     "reason": "no_available_printers",
                     "printers": [
-                        {
-                            "id": st.get("id"),
-                            "connected": st.get("connected"),
-                            "printer_state": st.get("printer_state"),
-                            "print_status": st.get("print_status"),
-                            "print_error_code": st.get("print_error_code"),
-                            "fail_reason": st.get("fail_reason"),
-                            "mc_print_error_code": st.get("mc_print_error_code"),
-                        }
+                        dict(zip(_STATUS_REPORT_KEYS, _get_status_report(st)))
                         for st in statuses.values()
                     ],
                 }
@@ -353,6 +497,7 @@ class Dispatcher:
 
 
 dispatcher = Dispatcher(config.dispatch_interval_sec)
+manager.set_status_callback(dispatcher.notify)
 
 
 @app.on_event("startup")
@@ -366,6 +511,10 @@ def on_startup() -> None:
 def on_shutdown() -> None:
     dispatcher.stop()
     manager.stop_all()
+    _BROADCAST_POOL.shutdown(wait=False)
+    for broker in list(_camera_brokers.values()):
+        broker.close()
+    queue.flush()
 
 
 @app.get("/", dependencies=[Depends(require_auth)])
@@ -444,6 +593,36 @@ def diag_ams_raw(printer_id: Optional[str] = Query(default=None)) -> dict:
     }
 
 
+DIAG_PRINT_KEYS = (
+    "gcode_state",
+    "state",
+    "stg",
+    "stg_cur",
+    "mc_print_stage",
+    "mc_print_sub_stage",
+    "mc_stage",
+    "mc_err",
+    "mc_print_error_code",
+    "print_error",
+    "fail_reason",
+    "err",
+    "hms",
+    "gcode_file",
+    "subtask_name",
+    "percent",
+    "remain_time",
+    "nozzle_diameter",
+    "nozzle_type",
+)
+DIAG_INFO_KEYS = ("model_id", "ver", "ip", "sn")
+
+
+def pick_keys(section: object, keys: tuple[str, ...]) -> dict:
+    if not isinstance(section, dict):
+        return {}
+    return {key: section[key] for key in keys if key in section}
+
+
 @app.get("/api/diag/state", dependencies=[Depends(require_auth)])
 def diag_state(printer_id: Optional[str] = Query(default=None)) -> dict:
     """
@@ -453,49 +632,10 @@ def diag_state(printer_id: Optional[str] = Query(default=None)) -> dict:
     dump = service.get_mqtt_dump()
     print_section = dump.get("print", {}) if isinstance(dump, dict) else {}
     info_section = dump.get("info", {}) if isinstance(dump, dict) else {}
-
-    def pick(section: dict, keys: tuple[str, ...]) -> dict:
-        out = {}
-        for key in keys:
-            if key in section:
-                out[key] = section.get(key)
-        return out
-
     return {
         "ok": True,
-        "print": pick(
-            print_section if isinstance(print_section, dict) else {},
-            (
-                "gcode_state",
-                "state",
-                "stg",
-                "stg_cur",
-                "mc_print_stage",
-                "mc_print_sub_stage",
-                "mc_stage",
-                "mc_err",
-                "mc_print_error_code",
-                "print_error",
-                "fail_reason",
-                "err",
-                "hms",
-                "gcode_file",
-                "subtask_name",
-                "percent",
-                "remain_time",
-                "nozzle_diameter",
-                "nozzle_type",
-            ),
-        ),
-        "info": pick(
-            info_section if isinstance(info_section, dict) else {},
-            (
-                "model_id",
-                "ver",
-                "ip",
-                "sn",
-            ),
-        ),
+        "print": pick_keys(print_section, DIAG_PRINT_KEYS),
+        "info": pick_keys(info_section, DIAG_INFO_KEYS),
     }
 
 @app.post("/api/pause", dependencies=[Depends(require_auth)])
@@ -569,11 +709,17 @@ def jog_home(printer_id: Optional[str] = Query(default=None)) -> dict:
 
 
 def broadcast(action):
+    # Iterate the long-lived services directly: list_printers() would copy every
+    # status under each printer's lock (and block behind in-flight commands)
+    # just to learn the ids.
+    futures = {
+        pid: _BROADCAST_POOL.submit(action, service)
+        for pid, service in manager.list_services().items()
+    }
     results = {}
-    for item in manager.list_printers():
-        pid = item["id"]
+    for pid, future in futures.items():
         try:
-            ok = bool(action(manager.get_service(pid)))
+            ok = bool(future.result())
             results[pid] = {"ok": ok}
         except Exception as exc:  # noqa: BLE001
             results[pid] = {"ok": False, "error": str(exc)}
@@ -662,7 +808,8 @@ def ams_select(body: AmsSelectRequest, printer_id: Optional[str] = Query(default
 
 
 @app.post("/api/upload", dependencies=[Depends(require_auth)])
-async def upload_file(
+def upload_file(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     start: bool = False,
     plate: int = 1,
@@ -675,6 +822,7 @@ async def upload_file(
     sliced = False
     filename = file.filename
     tmpdir: Optional[str] = None
+    succeeded = False
     try:
         if is_slicable_file(filename) and not presliced_3mf:
             output_path, output_name, tmpdir = slice_upload(file)
@@ -685,11 +833,12 @@ async def upload_file(
             upload_result = service.upload_file_obj(file.file, filename)
         if start:
             started = service.start_print(filename, plate=plate)
+        succeeded = True
     except RuntimeError as exc:
         raise HTTPException(status_code=400, detail=str(exc))
     finally:
         if tmpdir:
-            shutil.rmtree(tmpdir, ignore_errors=True)
+            cleanup_tmpdir(tmpdir, background_tasks if succeeded else None)
     return {"upload_result": upload_result, "started": started, "sliced": sliced, "filename": filename}
 
 
@@ -708,7 +857,8 @@ def list_jobs() -> list:
 
 
 @app.post("/api/jobs", dependencies=[Depends(require_auth)])
-async def enqueue_job(
+def enqueue_job(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     plate: int = 1,
     printer_id: Optional[str] = Query(default=None),
@@ -722,6 +872,7 @@ async def enqueue_job(
     filename = file.filename
     fileobj = file.file
     tmpdir: Optional[str] = None
+    succeeded = False
     try:
         if is_slicable_file(filename) and not presliced_3mf:
             output_path, output_name, tmpdir = slice_upload(file)
@@ -734,17 +885,18 @@ async def enqueue_job(
             printer_id=target,
             auto_assign=auto_assign,
         )
-        # Kick the dispatcher immediately so the queue feels responsive even
-        # if the periodic loop is delayed.
-        threading.Thread(target=dispatcher.dispatch_once, daemon=True).start()
+        # Wake the dispatcher immediately so the queue feels responsive
+        # instead of waiting out the fallback interval.
+        dispatcher.notify()
+        succeeded = True
     except RuntimeError as exc:
         raise HTTPException(status_code=400, detail=str(exc))
     finally:
         if hasattr(fileobj, "close") and fileobj is not file.file:
             fileobj.close()
         if tmpdir:
-            shutil.rmtree(tmpdir, ignore_errors=True)
-    return asdict(job)
+            cleanup_tmpdir(tmpdir, background_tasks if succeeded else None)
+    return job.to_dict()
 
 
 @app.post("/api/jobs/{job_id}/cancel", dependencies=[Depends(require_auth)])
@@ -754,7 +906,10 @@ def cancel_job(job_id: str) -> dict:
 
 @app.post("/api/jobs/{job_id}/complete", dependencies=[Depends(require_auth)])
 def complete_job(job_id: str) -> dict:
-    return {"ok": queue.mark_completed(job_id)}
+    ok = queue.mark_completed(job_id)
+    if ok:
+        dispatcher.notify()
+    return {"ok": ok}
 
 
 @app.delete("/api/jobs/{job_id}", dependencies=[Depends(require_auth)])
@@ -762,8 +917,25 @@ def remove_job(job_id: str) -> dict:
     return {"ok": queue.remove_job(job_id)}
 
 
+JOB_COUNTS_TTL_SEC = 0.25
+_job_counts_cache: Tuple[float, dict] = (float("-inf"), {})
+
+
+def job_counts() -> dict:
+    # Several dashboard tabs poll dispatch status at once; share one queue scan
+    # between requests that land within the same short window.
+    global _job_counts_cache
+    cached_at, counts = _job_counts_cache
+    now = time.monotonic()
+    if now - cached_at >= JOB_COUNTS_TTL_SEC:
+        counts = queue.count_by_status()
+        _job_counts_cache = (now, counts)
+    return counts
+
+
 @app.get("/api/dispatch/status", dependencies=[Depends(require_auth)])
 def dispatch_status() -> dict:
+    snapshot = dispatcher._snapshot
     thread_alive = bool(dispatcher._thread and dispatcher._thread.is_alive())
     printers = []
     for st in manager.list_printers():
@@ -786,19 +958,20 @@ def dispatch_status() -> dict:
                 "available": available,
             }
         )
+    counts = job_counts()
     return {
         "running": bool(dispatcher._running),
         "thread_alive": thread_alive,
         "interval_sec": config.dispatch_interval_sec,
-        "last_dispatch_at": dispatcher._last_dispatch_at,
-        "last_error": dispatcher._last_error,
-        "last_result": dispatcher._last_result,
+        "last_dispatch_at": snapshot.dispatched_at,
+        "last_error": snapshot.error,
+        "last_result": snapshot.result,
         "printers": printers,
         "jobs": {
-            "queued": len(queue.list_jobs(status="queued")),
-            "dispatching": len(queue.list_jobs(status="dispatching")),
-            "running": len(queue.list_jobs(status="running")),
-            "failed": len(queue.list_jobs(status="failed")),
+            "queued": counts.get("queued", 0),
+            "dispatching": counts.get("dispatching", 0),
+            "running": counts.get("running", 0),
+            "failed": counts.get("failed", 0),
         },
     }
 
@@ -812,12 +985,59 @@ def dispatch_once() -> dict:
     return {"ok": True, "result": result}
 
 
-def mjpeg_stream(url: str):
-    ffmpeg = shutil.which("ffmpeg")
-    if not ffmpeg:
+# Camera URL -> video codec name, from the first successful ffprobe.
+_camera_codecs: dict[str, str] = {}
+# Camera URL -> monotonic time before which a failed probe is not retried.
+_camera_probe_retry_at: dict[str, float] = {}
+
+
+def probe_video_codec(url: str) -> Optional[str]:
+    codec = _camera_codecs.get(url)
+    if codec is not None or not FFPROBE_BIN:
+        return codec
+    if time.monotonic() < _camera_probe_retry_at.get(url, 0.0):
+        return None
+    cmd = [
+        FFPROBE_BIN,
+        "-v",
+        "error",
+        "-rtsp_transport",
+        "tcp",
+        "-timeout",
+        "5000000",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "stream=codec_name",
+        "-of",
+        "default=noprint_wrappers=1:nokey=1",
+        url,
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=8.0)
+    except (OSError, subprocess.TimeoutExpired):
+        result = None
+    codec = result.stdout.decode("utf-8", errors="ignore").strip().lower() if result else ""
+    if result is None or result.returncode != 0 or not codec:
+        # Camera unreachable right now; probe again after a short back-off.
+        _camera_probe_retry_at[url] = time.monotonic() + CODEC_PROBE_RETRY_SEC
+        return None
+    _camera_probe_retry_at.pop(url, None)
+    _camera_codecs[url] = codec
+    return codec
+
+
+def open_mjpeg_ffmpeg(url: str) -> subprocess.Popen:
+    if not FFMPEG_BIN:
         raise HTTPException(status_code=501, detail="ffmpeg not installed")
+    if probe_video_codec(url) == "mjpeg":
+        # Frames are already JPEG: remux them instead of decode/scale/re-encode.
+        # (Filters and -r need a re-encode, so they only apply to other codecs.)
+        output_args = ["-c:v", "copy"]
+    else:
+        output_args = ["-vf", "scale=960:-1", "-r", "5"]
     cmd = [
-        ffmpeg,
+        FFMPEG_BIN,
         "-hide_banner",
         "-loglevel",
         "error",
@@ -834,10 +1054,7 @@ def mjpeg_stream(url: str):
         "-i",
         url,
         "-an",
-        "-vf",
-        "scale=960:-1",
-        "-r",
-        "5",
+        *output_args,
         "-f",
         "mjpeg",
         "pipe:1",
@@ -850,9 +1067,31 @@ def mjpeg_stream(url: str):
     )
     if proc.stdout is None:
         raise HTTPException(status_code=500, detail="ffmpeg failed to start")
+    if fcntl is not None and hasattr(fcntl, "F_SETPIPE_SZ"):
+        try:
+            fcntl.fcntl(proc.stdout.fileno(), fcntl.F_SETPIPE_SZ, MJPEG_PIPE_SIZE)
+        except OSError:
+            # Above /proc/sys/fs/pipe-max-size for unprivileged users; keep default.
+            pass
     # If ffmpeg exits immediately (bad flags, auth errors, etc.), surface the
-    # error instead of returning a silent black/empty feed.
-    time.sleep(0.15)
+    # error instead of returning a silent black/empty feed. Return as soon as
+    # the first bytes arrive rather than after a fixed sleep.
+    if os.name == "nt":
+        # select() only accepts sockets on Windows.
+        time.sleep(0.15)
+    else:
+        deadline = time.monotonic() + MJPEG_STARTUP_WAIT_SEC
+        while proc.poll() is None and time.monotonic() < deadline:
+            ready, _, _ = select.select([proc.stdout, proc.stderr], [], [], 0.02)
+            if proc.stderr in ready:
+                # Error output (or EOF because it exited): let ffmpeg finish.
+                try:
+                    proc.wait(timeout=0.15)
+                except subprocess.TimeoutExpired:
+                    pass
+                break
+            if ready:
+                break
     if proc.poll() is not None:
         try:
             stderr = (proc.stderr.read() if proc.stderr else b"")  # type: ignore[union-attr]
@@ -862,52 +1101,230 @@ def mjpeg_stream(url: str):
         if not msg:
             msg = f"ffmpeg exited with code {proc.returncode}"
         raise HTTPException(status_code=500, detail=msg[:800])
-
-    boundary = b"--frame\r\n"
-    buffer = b""
-
-    def generate():
-        nonlocal buffer
+    return proc
+
+
+def iter_jpeg_frames(stream):
+    # bytearray so appends are amortized O(1) and trimming the consumed head
+    # (del buffer[:n]) doesn't copy the remainder like bytes slicing did.
+    buffer = bytearray()
+    # Offsets where the next SOI/EOI search resumes. A frame usually spans
+    # several reads; without these every read rescans the partial frame.
+    # Resuming one byte early catches a marker split across two reads.
+    soi_from = 0
+    eoi_from = 0
+    while True:
+        chunk = stream.read(MJPEG_READ_CHUNK)
+        if not chunk:
+            return
+        buffer.extend(chunk)
+        while True:
+            start = buffer.find(b"\xff\xd8", soi_from)
+            if start == -1:
+                # No frame starts here; only a trailing 0xff (half of a split
+                # SOI) can still matter.
+                del buffer[:-1]
+                soi_from = 0
+                break
+            end = buffer.find(b"\xff\xd9", max(start + 2, eoi_from))
+            if end == -1:
+                if len(buffer) - start > MJPEG_MAX_FRAME_BYTES:
+                    # EOI lost; drop the runaway frame and resync on the next SOI.
+                    del buffer[: start + 2]
+                    soi_from = 0
+                    eoi_from = 0
+                    continue
+                if start > 0:
+                    del buffer[:start]
+                soi_from = 0
+                eoi_from = max(len(buffer) - 1, 2)
+                break
+            # The view is released before the buffer is resized below.
+            with memoryview(buffer) as view:
+                frame = view[start : end + 2].tobytes()
+            del buffer[: end + 2]
+            soi_from = 0
+            eoi_from = 0
+            yield frame
+
+
+class CameraBroker:
+    # One ffmpeg per camera URL; every /api/camera viewer of that URL reads the
+    # same frames. Viewers that fall behind skip to the newest frame rather
+    # than queueing old ones. ffmpeg is killed when the last viewer leaves.
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self._cond = threading.Condition()
+        self._start_lock = threading.Lock()
+        self._proc: Optional[subprocess.Popen] = None
+        self._refs = 0
+        self._closed = False
+        self._seq = 0
+        self._frame: Optional[bytes] = None
+        self._part: Optional[bytes] = None
+        self._frame_at = 0.0
+        self._warm_until = 0.0
+        self._warm = False
+
+    @classmethod
+    def acquire(cls, url: str) -> "CameraBroker":
+        with _camera_brokers_lock:
+            broker = _camera_brokers.get(url)
+            if broker is None or broker._closed:
+                broker = cls(url)
+                _camera_brokers[url] = broker
+            broker._refs += 1
         try:
-            while True:
-                chunk = proc.stdout.read(4096)
-                if not chunk:
+            broker._start()
+        except Exception:
+            broker._release()
+            raise
+        return broker
+
+    @classmethod
+    def latest_frame(cls, url: str, max_age: float) -> Optional[bytes]:
+        with _camera_brokers_lock:
+            broker = _camera_brokers.get(url)
+        if broker is None:
+            return None
+        with broker._cond:
+            if broker._closed or broker._frame is None:
+                return None
+            if time.monotonic() - broker._frame_at > max_age:
+                return None
+            return broker._frame
+
+    @classmethod
+    def grab(cls, url: str, timeout: float) -> bytes:
+        broker = cls.acquire(url)
+        try:
+            broker._keep_warm(SNAPSHOT_WARM_SEC)
+            deadline = time.monotonic() + timeout
+            with broker._cond:
+                seen = broker._seq
+                while broker._seq == seen and not broker._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise HTTPException(status_code=504, detail="Camera snapshot timed out")
+                    broker._cond.wait(remaining)
+                if broker._seq == seen:
+                    raise HTTPException(status_code=500, detail="Camera stream ended before a frame arrived")
+                return broker._frame  # type: ignore[return-value]
+        finally:
+            broker._release()
+
+    def _keep_warm(self, seconds: float) -> None:
+        # Holds one extra reference until `seconds` after the latest call.
+        with _camera_brokers_lock:
+            self._warm_until = time.monotonic() + seconds
+            if self._warm:
+                return
+            self._warm = True
+            self._refs += 1
+        threading.Thread(target=self._cool_down, daemon=True).start()
+
+    def _cool_down(self) -> None:
+        while True:
+            with _camera_brokers_lock:
+                remaining = self._warm_until - time.monotonic()
+                if remaining <= 0:
+                    self._warm = False
                     break
-                buffer += chunk
-                while True:
-                    start = buffer.find(b"\xff\xd8")
-                    if start == -1:
-                        if len(buffer) > 2_000_000:
-                            buffer = buffer[-2_000_000:]
-                        break
-                    end = buffer.find(b"\xff\xd9", start + 2)
-                    if end == -1:
-                        if start > 0:
-                            buffer = buffer[start:]
-                        break
-                    frame = buffer[start : end + 2]
-                    buffer = buffer[end + 2 :]
-                    headers = (
-                        boundary
-                        + b"Content-Type: image/jpeg\r\n"
-                        + f"Content-Length: {len(frame)}\r\n\r\n".encode("utf-8")
+            time.sleep(remaining)
+        self._release()
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._proc is not None:
+                return
+            if self._closed:
+                # A concurrent first viewer failed to start ffmpeg.
+                raise HTTPException(status_code=503, detail="Camera stream unavailable, retry")
+            self._proc = open_mjpeg_ffmpeg(self.url)
+            threading.Thread(target=self._pump, args=(self._proc,), daemon=True).start()
+
+    def _pump(self, proc: subprocess.Popen) -> None:
+        try:
+            for frame in iter_jpeg_frames(proc.stdout):
+                # Built once here and shared by every viewer.
+                part = b"".join(
+                    (
+                        b"--frame\r\nContent-Type: image/jpeg\r\n",
+                        f"Content-Length: {len(frame)}\r\n\r\n".encode("utf-8"),
+                        frame,
+                        b"\r\n",
                     )
-                    yield headers + frame + b"\r\n"
+                )
+                with self._cond:
+                    if self._closed:
+                        break
+                    self._frame = frame
+                    self._part = part
+                    self._frame_at = time.monotonic()
+                    self._seq += 1
+                    self._cond.notify_all()
+        except (OSError, ValueError):
+            # Pipe closed underneath us by close().
+            pass
         finally:
+            self.close()
+
+    def close(self) -> None:
+        with _camera_brokers_lock:
+            if _camera_brokers.get(self.url) is self:
+                del _camera_brokers[self.url]
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        proc = self._proc
+        if proc is not None:
             try:
                 proc.kill()
             except OSError:
                 pass
 
-    return generate()
+    def _release(self) -> None:
+        with _camera_brokers_lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+            # Retire the broker before dropping the lock, so acquire() can't
+            # hand it to a new viewer just before close() kills ffmpeg.
+            self._closed = True
+            if _camera_brokers.get(self.url) is self:
+                del _camera_brokers[self.url]
+        self.close()
+
+    def stream(self):
+        seen = 0
+        try:
+            while True:
+                with self._cond:
+                    while self._seq == seen and not self._closed:
+                        self._cond.wait()
+                    if self._seq == seen:
+                        return
+                    seen = self._seq
+                    part = self._part
+                yield part
+        finally:
+            self._release()
+
+
+_camera_brokers: dict[str, CameraBroker] = {}
+_camera_brokers_lock = threading.Lock()
+
+
+def mjpeg_stream(url: str):
+    return CameraBroker.acquire(url).stream()
 
 
 def mjpeg_snapshot(url: str, timeout_sec: float = 8.0) -> bytes:
-    ffmpeg = shutil.which("ffmpeg")
-    if not ffmpeg:
+    if not FFMPEG_BIN:
         raise HTTPException(status_code=501, detail="ffmpeg not installed")
     cmd = [
-        ffmpeg,
+        FFMPEG_BIN,
         "-hide_banner",
         "-loglevel",
         "error",
@@ -960,7 +1377,9 @@ def camera_snapshot(printer_id: Optional[str] = Query(default=None)) -> Response
     url = service.get_camera_url()
     if not url:
         raise HTTPException(status_code=404, detail="Camera disabled or not configured")
-    frame = mjpeg_snapshot(url)
+    frame = CameraBroker.latest_frame(url, SNAPSHOT_MAX_AGE_SEC)
+    if frame is None:
+        frame = CameraBroker.grab(url, timeout=8.0)
     return Response(content=frame, media_type="image/jpeg", headers={"Cache-Control": "no-cache"})
 
 
@@ -1,16 +1,69 @@
 from __future__ import annotations
 
-import json
+import hashlib
+import logging
 import os
+import re
 import shutil
+import tempfile
 import threading
 import time
 import uuid
-from dataclasses import asdict, dataclass
+from dataclasses import dataclass
 from typing import Dict, List, Optional
 
+import orjson
 
-@dataclass
+logger = logging.getLogger(__name__)
+
+COPY_BUFSIZE = 1024 * 1024
+# Status transitions are batched into one queue.json rewrite per window.
+PERSIST_DEBOUNCE_SEC = 0.1
+# Delay before retrying a failed background write of queue.json.
+PERSIST_RETRY_SEC = 1.0
+# Anything but letters/digits (unicode, like str.isalnum), "_", "." and "-".
+_UNSAFE_FILENAME_RE = re.compile(r"[^\w.-]+")
+
+
+def _disk_fileno(fileobj) -> Optional[int]:
+    # SpooledTemporaryFile.fileno() forces an in-memory spool onto disk, which
+    # would cost more than it saves; only use fds that already exist.
+    if isinstance(fileobj, tempfile.SpooledTemporaryFile) and not getattr(fileobj, "_rolled", True):
+        return None
+    try:
+        return fileobj.fileno()
+    except (AttributeError, OSError):
+        return None
+
+
+def copy_fileobj(src, dst) -> None:
+    # Copy src (from its current position) into the binary file dst. Uses a
+    # kernel-side sendfile() when src is backed by a real file, otherwise a
+    # large-buffer copyfileobj.
+    src_fd = _disk_fileno(src)
+    if src_fd is not None and hasattr(os, "sendfile"):
+        src_start = src.tell()
+        dst.flush()
+        dst_start = dst.tell()
+        try:
+            size = os.fstat(src_fd).st_size
+            offset = src_start
+            while offset < size:
+                sent = os.sendfile(dst.fileno(), src_fd, offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+            dst.seek(dst_start + offset - src_start)
+            return
+        except OSError:
+            # e.g. platforms where sendfile only targets sockets.
+            dst.seek(dst_start)
+            dst.truncate()
+            src.seek(src_start)
+    shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+
+
+@dataclass(slots=True)
 class Job:
     id: str
     filename: str
@@ -24,12 +77,43 @@ class Job:
     plate: int
     auto_assign: bool
     error: Optional[str]
+    # BLAKE2b of the stored file; identical uploads share one file.
+    file_hash: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "filepath": self.filepath,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "printer_id": self.printer_id,
+            "assigned_printer_id": self.assigned_printer_id,
+            "plate": self.plate,
+            "auto_assign": self.auto_assign,
+            "error": self.error,
+            "file_hash": self.file_hash,
+        }
 
 
 class JobQueue:
-    def __init__(self, storage_dir: str = "jobs") -> None:
+    def __init__(self, storage_dir: str = "jobs", durable: bool = False) -> None:
         self._lock = threading.RLock()
+        # fsync queue.json before replacing it; otherwise rely on OS write-back.
+        self._durable = durable
         self._jobs: Dict[str, Job] = {}
+        # status -> {job_id: job}; lets the dispatcher look at queued/running
+        # jobs without scanning the whole (ever-growing) history.
+        self._by_status: Dict[str, Dict[str, Job]] = {}
+        # Serialized, created_at-sorted listings keyed by status (None = all).
+        # Dropped on every mutation; the dicts are shared, so callers must not
+        # modify them.
+        self._list_cache: Dict[Optional[str], List[Dict[str, object]]] = {}
+        # file hash -> stored path, and stored path -> number of jobs using it.
+        self._by_hash: Dict[str, str] = {}
+        self._path_refs: Dict[str, int] = {}
         self._storage_dir = os.path.abspath(storage_dir)
         # Historic queue.json entries stored paths like "jobs\\files\\..."
         # (relative to the repo root). When running from a different CWD, those
@@ -40,6 +124,9 @@ class JobQueue:
         self._meta_path = os.path.join(self._storage_dir, "queue.json")
         os.makedirs(self._files_dir, exist_ok=True)
         self._load()
+        self._dirty = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
 
     def _abs_path(self, filepath: str) -> str:
         if not filepath:
@@ -55,42 +142,125 @@ class JobQueue:
         if not os.path.exists(self._meta_path):
             return
         try:
-            with open(self._meta_path, "r", encoding="utf-8") as handle:
-                data = json.load(handle)
-        except json.JSONDecodeError:
+            with open(self._meta_path, "rb") as handle:
+                data = orjson.loads(handle.read())
+        except orjson.JSONDecodeError:
             # Corrupt queue file; keep the instance usable (new jobs can still be enqueued).
             return
         touched = False
         for item in data.get("jobs", []):
-            job = Job(**item)
+            job = Job(
+                item["id"],
+                item["filename"],
+                item["filepath"],
+                item["status"],
+                item["created_at"],
+                item.get("started_at"),
+                item.get("finished_at"),
+                item.get("printer_id"),
+                item.get("assigned_printer_id"),
+                item["plate"],
+                item["auto_assign"],
+                item.get("error"),
+                item.get("file_hash"),
+            )
             abs_path = self._abs_path(job.filepath)
             if abs_path != job.filepath:
                 job.filepath = abs_path
                 touched = True
             self._jobs[job.id] = job
+            self._by_status.setdefault(job.status, {})[job.id] = job
+            self._path_refs[job.filepath] = self._path_refs.get(job.filepath, 0) + 1
+            if job.file_hash:
+                self._by_hash.setdefault(job.file_hash, job.filepath)
         if touched:
             self._persist()
 
     def _persist(self) -> None:
-        payload = {"jobs": [asdict(job) for job in self._jobs.values()]}
+        payload = orjson.dumps({"jobs": [job.to_dict() for job in self._jobs.values()]})
         tmp_path = self._meta_path + ".tmp"
-        with open(tmp_path, "w", encoding="utf-8") as handle:
-            json.dump(payload, handle, indent=2)
+        with open(tmp_path, "wb") as handle:
+            handle.write(payload)
+            if self._durable:
+                handle.flush()
+                os.fsync(handle.fileno())
         os.replace(tmp_path, self._meta_path)
 
+    def _flush_loop(self) -> None:
+        while True:
+            self._dirty.wait()
+            time.sleep(PERSIST_DEBOUNCE_SEC)
+            self._dirty.clear()
+            try:
+                with self._lock:
+                    self._persist()
+            except Exception:  # noqa: BLE001
+                # Disk full, permissions, a Windows replace conflict...: keep
+                # the thread alive and retry, or later updates never hit disk.
+                logger.exception("Failed to write %s; retrying", self._meta_path)
+                self._dirty.set()
+                time.sleep(PERSIST_RETRY_SEC)
+
+    def _schedule_persist(self) -> None:
+        self._dirty.set()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._dirty.clear()
+            self._persist()
+
+    def _set_status(self, job: Job, status: str) -> None:
+        bucket = self._by_status.get(job.status)
+        if bucket is not None:
+            bucket.pop(job.id, None)
+        job.status = status
+        self._by_status.setdefault(status, {})[job.id] = job
+        self._list_cache.clear()
+
+    def _hash_fileobj(self, fileobj) -> Optional[str]:
+        # Hash from the current position, then rewind for the copy. Streams that
+        # can't rewind are stored without dedupe.
+        try:
+            if not fileobj.seekable():
+                return None
+            start = fileobj.tell()
+        except (AttributeError, OSError, ValueError):
+            return None
+        try:
+            return hashlib.file_digest(fileobj, "blake2b").hexdigest()
+        except ValueError:
+            # file_digest needs readinto()/getbuffer(); plain read() wrappers
+            # are still accepted, just not deduplicated.
+            return None
+        finally:
+            fileobj.seek(start)
+
     def _safe_filename(self, filename: str) -> str:
-        base = os.path.basename(filename)
-        cleaned = "".join(c for c in base if c.isalnum() or c in "._-")
-        cleaned = cleaned.strip("._")
+        cleaned = _UNSAFE_FILENAME_RE.sub("", os.path.basename(filename)).strip("._")
         return cleaned or "job.gcode"
 
-    def list_jobs(self, status: Optional[str] = None) -> List[Dict[str, object]]:
-        with self._lock:
-            jobs = list(self._jobs.values())
+    def _listing(self, status: Optional[str]) -> List[Dict[str, object]]:
+        cached = self._list_cache.get(status)
+        if cached is None:
             if status:
-                jobs = [job for job in jobs if job.status == status]
+                jobs = list(self._by_status.get(status, {}).values())
+            else:
+                jobs = list(self._jobs.values())
             jobs.sort(key=lambda job: job.created_at)
-            return [asdict(job) for job in jobs]
+            cached = self._list_cache[status] = [job.to_dict() for job in jobs]
+        return cached
+
+    def list_jobs(self, status: Optional[str] = None) -> List[Dict[str, object]]:
+        with self._lock:
+            return list(self._listing(status or None))
+
+    def list_jobs_by_status(self, *statuses: str) -> Dict[str, List[Dict[str, object]]]:
+        with self._lock:
+            return {status: list(self._listing(status)) for status in statuses}
+
+    def count_by_status(self) -> Dict[str, int]:
+        with self._lock:
+            return {status: len(bucket) for status, bucket in self._by_status.items() if bucket}
 
     def get_job(self, job_id: str) -> Optional[Job]:
         with self._lock:
@@ -104,32 +274,60 @@ class JobQueue:
         printer_id: Optional[str] = None,
         auto_assign: bool = True,
     ) -> Job:
+        # The copy can take a while for large uploads; the unique job id makes
+        # the target path private, so only the bookkeeping needs the lock.
+        job_id = uuid.uuid4().hex[:12]
+        safe_name = self._safe_filename(filename)
+        filepath = os.path.join(self._files_dir, f"{job_id}__{safe_name}")
+        if hasattr(fileobj, "seek"):
+            try:
+                fileobj.seek(0)
+            except OSError:
+                pass
+        file_hash = self._hash_fileobj(fileobj)
         with self._lock:
-            job_id = uuid.uuid4().hex[:12]
-            safe_name = self._safe_filename(filename)
-            filepath = os.path.join(self._files_dir, f"{job_id}__{safe_name}")
-            if hasattr(fileobj, "seek"):
+            existing = self._by_hash.get(file_hash) if file_hash else None
+            if existing and os.path.exists(existing):
+                # Same bytes as an earlier upload (e.g. the same plate
+                # re-sliced). Take the reference now so remove_job can't
+                # delete the file before this job is inserted.
+                self._path_refs[existing] = self._path_refs.get(existing, 0) + 1
+                filepath = existing
+            else:
+                existing = None
+        if existing is None:
+            try:
+                with open(filepath, "wb") as out:
+                    copy_fileobj(fileobj, out)
+            except BaseException:
                 try:
-                    fileobj.seek(0)
+                    os.remove(filepath)
                 except OSError:
                     pass
-            with open(filepath, "wb") as out:
-                shutil.copyfileobj(fileobj, out)
-            job = Job(
-                id=job_id,
-                filename=safe_name,
-                filepath=filepath,
-                status="queued",
-                created_at=time.time(),
-                started_at=None,
-                finished_at=None,
-                printer_id=printer_id,
-                assigned_printer_id=None,
-                plate=plate,
-                auto_assign=auto_assign,
-                error=None,
-            )
+                raise
+        job = Job(
+            id=job_id,
+            filename=safe_name,
+            filepath=filepath,
+            status="queued",
+            created_at=time.time(),
+            started_at=None,
+            finished_at=None,
+            printer_id=printer_id,
+            assigned_printer_id=None,
+            plate=plate,
+            auto_assign=auto_assign,
+            error=None,
+            file_hash=file_hash,
+        )
+        with self._lock:
             self._jobs[job_id] = job
+            if existing is None:
+                self._path_refs[filepath] = self._path_refs.get(filepath, 0) + 1
+                if file_hash:
+                    self._by_hash[file_hash] = filepath
+            self._by_status.setdefault(job.status, {})[job_id] = job
+            self._list_cache.clear()
             self._persist()
             return job
 
@@ -138,9 +336,11 @@ class JobQueue:
             job = self._jobs.get(job_id)
             if not job or job.status != "queued":
                 return False
-            job.status = "dispatching"
+            self._set_status(job, "dispatching")
             job.assigned_printer_id = printer_id
             job.started_at = time.time()
+            # Written immediately: a lost "dispatching" would re-dispatch the
+            # job to another printer after a crash.
             self._persist()
             return True
 
@@ -149,8 +349,8 @@ class JobQueue:
             job = self._jobs.get(job_id)
             if not job:
                 return False
-            job.status = "running"
-            self._persist()
+            self._set_status(job, "running")
+            self._schedule_persist()
             return True
 
     def mark_failed(self, job_id: str, error: str) -> bool:
@@ -158,10 +358,10 @@ class JobQueue:
             job = self._jobs.get(job_id)
             if not job:
                 return False
-            job.status = "failed"
+            self._set_status(job, "failed")
             job.error = error
             job.finished_at = time.time()
-            self._persist()
+            self._schedule_persist()
             return True
 
     def mark_canceled(self, job_id: str) -> bool:
@@ -171,9 +371,9 @@ class JobQueue:
                 return False
             if job.status in {"completed", "failed"}:
                 return False
-            job.status = "canceled"
+            self._set_status(job, "canceled")
             job.finished_at = time.time()
-            self._persist()
+            self._schedule_persist()
             return True
 
     def mark_completed(self, job_id: str) -> bool:
@@ -181,9 +381,9 @@ class JobQueue:
             job = self._jobs.get(job_id)
             if not job:
                 return False
-            job.status = "completed"
+            self._set_status(job, "completed")
             job.finished_at = time.time()
-            self._persist()
+            self._schedule_persist()
             return True
 
     def remove_job(self, job_id: str) -> bool:
@@ -191,10 +391,19 @@ class JobQueue:
             job = self._jobs.pop(job_id, None)
             if not job:
                 return False
-            try:
-                if os.path.exists(job.filepath):
-                    os.remove(job.filepath)
-            except OSError:
-                pass
+            self._by_status.get(job.status, {}).pop(job_id, None)
+            self._list_cache.clear()
+            refs = self._path_refs.pop(job.filepath, 1) - 1
+            if refs > 0:
+                # Another job still uses this (deduplicated) file.
+                self._path_refs[job.filepath] = refs
+            else:
+                if job.file_hash and self._by_hash.get(job.file_hash) == job.filepath:
+                    del self._by_hash[job.file_hash]
+                try:
+                    if os.path.exists(job.filepath):
+                        os.remove(job.filepath)
+                except OSError:
+                    pass
             self._persist()
             return True
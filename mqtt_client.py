@@ -1,15 +1,16 @@
 ﻿from __future__ import annotations
 
-import json
 import ssl
 import threading
 import time
 from dataclasses import dataclass
+from functools import lru_cache
 from io import BytesIO
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 import bambulabs_api as bl
+import orjson
 import paho.mqtt.client as mqtt
 from bambulabs_api.filament_info import AMSFilamentSettings
 from bambulabs_api.states_info import GcodeState, PrintStatus
@@ -18,9 +19,42 @@ DEFAULT_CAMERA_PROTOCOL = "rtsps"
 DEFAULT_CAMERA_PORT = 322
 DEFAULT_CAMERA_PATH = "/streaming/live/1"
 DEFAULT_CAMERA_USER = "bblp"
+# Report-driven refreshes are spaced at least this far apart; printing
+# printers can send several reports per second.
+MIN_REFRESH_INTERVAL_SEC = 0.5
+# Bound on waiting for a publish to leave; paho's default wait is unbounded.
+MQTT_PUBLISH_TIMEOUT_SEC = 5.0
+
+# gcode_state targets for command waits (frozensets: hashed membership).
+_DONE_STATES = frozenset({GcodeState.IDLE, GcodeState.FINISH, GcodeState.FAILED})
+_CLEARED_STATES = frozenset({GcodeState.IDLE, GcodeState.FINISH})
+_PAUSED_STATES = frozenset({GcodeState.PAUSE})
+_RUNNING_STATES = frozenset({GcodeState.RUNNING})
+# What a paho publish can raise (wait_for_publish, socket errors); anything
+# else from a pushall is a bug and should surface.
+_PUBLISH_ERRORS = (RuntimeError, ValueError, OSError)
+# Fan percent (0-100) -> M106 S value (0-255).
+_PCT_TO_PWM = tuple(int(round(255 * (p / 100.0))) for p in range(101))
+# ledctrl node names firmwares use for the logo LED.
+_LOGO_LED_NODES = ("logo_light", "logo", "logo_led", "led_logo")
+
+
+def _wait_published(info: mqtt.MQTTMessageInfo) -> bool:
+    try:
+        info.wait_for_publish(timeout=MQTT_PUBLISH_TIMEOUT_SEC)
+    except (RuntimeError, ValueError):
+        # Not connected / message not queued.
+        return False
+    return info.is_published()
 
 
-@dataclass
+@lru_cache(maxsize=256)
+def _normalize_color(value: Optional[str]) -> str:
+    # Trays report RRGGBBAA; the filament command wants RRGGBB.
+    return (value or "FFFFFF").lstrip("#").ljust(6, "F")[:6]
+
+
+@dataclass(frozen=True)
 class PrinterConfig:
     printer_id: str
     name: str
@@ -34,6 +68,87 @@ class PrinterConfig:
     camera_user: str
     camera_url: Optional[str]
 
+    def __post_init__(self) -> None:
+        # Build the default camera URL once instead of on every request.
+        if self.camera_enabled and not self.camera_url:
+            path = self.camera_path
+            if not path.startswith("/"):
+                path = "/" + path
+            url = (
+                f"{self.camera_protocol}://{self.camera_user}:{self.access_code}@"
+                f"{self.printer_ip}:{self.camera_port}{path}"
+            )
+            object.__setattr__(self, "camera_url", url)
+
+
+@dataclass(frozen=True, slots=True)
+class SelectedAms:
+    ams_id: int
+    tray_id: int
+    tool_id: int
+
+
+@dataclass(slots=True)
+class PrinterStatus:
+    id: str
+    name: str
+    connected: bool = False
+    last_update: Optional[float] = None
+    last_error: Optional[str] = None
+    printer_state: Optional[GcodeState] = None
+    print_status: Optional[str] = None
+    filament_runout: Optional[bool] = None
+    sequence_id: Optional[int] = None
+    print_error_code: Optional[int] = None
+    print_error_raw: Any = None
+    fail_reason: Any = None
+    mc_print_error_code: Any = None
+    hms: Any = None
+    gcode_file: Optional[str] = None
+    subtask_name: Optional[str] = None
+    selected_ams: Optional[SelectedAms] = None
+    last_start_ams_mapping: Optional[List[int]] = None
+    part_fan_percent: Optional[int] = None
+    aux_fan_percent: Optional[int] = None
+    chamber_fan_percent: Optional[int] = None
+    percentage: Any = None
+    bed_temp: Optional[float] = None
+    nozzle_temp: Optional[float] = None
+    remaining_time: Any = None
+    camera_enabled: bool = True
+    light_state: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "connected": self.connected,
+            "last_update": self.last_update,
+            "last_error": self.last_error,
+            "printer_state": self.printer_state,
+            "print_status": self.print_status,
+            "filament_runout": self.filament_runout,
+            "sequence_id": self.sequence_id,
+            "print_error_code": self.print_error_code,
+            "print_error_raw": self.print_error_raw,
+            "fail_reason": self.fail_reason,
+            "mc_print_error_code": self.mc_print_error_code,
+            "hms": self.hms,
+            "gcode_file": self.gcode_file,
+            "subtask_name": self.subtask_name,
+            "selected_ams": self.selected_ams,
+            "last_start_ams_mapping": self.last_start_ams_mapping,
+            "part_fan_percent": self.part_fan_percent,
+            "aux_fan_percent": self.aux_fan_percent,
+            "chamber_fan_percent": self.chamber_fan_percent,
+            "percentage": self.percentage,
+            "bed_temp": self.bed_temp,
+            "nozzle_temp": self.nozzle_temp,
+            "remaining_time": self.remaining_time,
+            "camera_enabled": self.camera_enabled,
+            "light_state": self.light_state,
+        }
+
 
 @dataclass
 class FarmConfig:
@@ -43,7 +158,8 @@ class FarmConfig:
 
 
 def load_config(path: str = "config.json") -> FarmConfig:
-    data = json.loads(Path(path).read_text(encoding="utf-8-sig"))
+    # orjson parses bytes directly; strip a UTF-8 BOM (Notepad adds one).
+    data = orjson.loads(Path(path).read_bytes().removeprefix(b"\xef\xbb\xbf"))
     poll_interval = float(data.get("poll_interval_sec", 2.0))
     dispatch_interval = float(data.get("dispatch_interval_sec", 3.0))
     printers: List[PrinterConfig] = []
@@ -76,40 +192,45 @@ class PrinterService:
         self._poll_interval_sec = poll_interval_sec
         self._printer: Optional[bl.Printer] = None
         self._lock = threading.RLock()
+        # The printer's FTP client is one shared session: transfers take this
+        # lock instead of _lock so polling and commands keep running.
+        self._upload_lock = threading.Lock()
         self._running = False
         self._thread: Optional[threading.Thread] = None
-        self._selected_ams: Optional[dict[str, int]] = None
-        self._status: Dict[str, Any] = {
-            "id": config.printer_id,
-            "name": config.name,
-            "connected": False,
-            "last_update": None,
-            "last_error": None,
-            "printer_state": None,
-            "print_status": None,
-            "filament_runout": None,
-            "sequence_id": None,
-            "print_error_code": None,
-            "print_error_raw": None,
-            "fail_reason": None,
-            "mc_print_error_code": None,
-            "hms": None,
-            "gcode_file": None,
-            "subtask_name": None,
-            "selected_ams": None,
-            "last_start_ams_mapping": None,
-            "part_fan_percent": None,
-            "aux_fan_percent": None,
-            "chamber_fan_percent": None,
-            "percentage": None,
-            "bed_temp": None,
-            "nozzle_temp": None,
-            "remaining_time": None,
-            "camera_enabled": config.camera_enabled,
-            "light_state": None,
-        }
+        self._side_client: Optional[mqtt.Client] = None
+        self._selected_ams: Optional[SelectedAms] = None
+        # AMSFilamentSettings is frozen, so re-selecting a tray reuses it.
+        self._filament_settings: dict[tuple, AMSFilamentSettings] = {}
+        # (ams_id, tray_id) -> tray dict from the last _get_ams_raw() call.
+        self._ams_tray_index: dict[tuple[int, int], dict[str, Any]] = {}
+        self._status = PrinterStatus(
+            id=config.printer_id,
+            name=config.name,
+            camera_enabled=config.camera_enabled,
+        )
+        # Read-only copy of _status for get_status(). Writers mutate _status
+        # under the lock and then publish a fresh copy; readers take no lock.
+        self._status_snapshot: Dict[str, Any] = self._status.to_dict()
         self._next_connect_time = 0.0
         self._backoff_sec = 2.0
+        # Invoked (outside the lock) when connection or printer_state changes.
+        self._on_status_change: Optional[Callable[[], None]] = None
+        # Set from the MQTT network thread when a report arrives, so the poll
+        # loop refreshes right away instead of sleeping out the interval.
+        self._report_event = threading.Event()
+        # Same signal for _wait_for_gcode_state (kept separate: the poll loop
+        # clears its own event).
+        self._state_event = threading.Event()
+        # Monotonic arrival time of the latest MQTT report.
+        self._last_report_at: Optional[float] = None
+        # (mode, monotonic time) of the last chamber_light ledctrl we sent.
+        self._chamber_light_sent: Optional[tuple[str, float]] = None
+
+    def set_status_callback(self, callback: Optional[Callable[[], None]]) -> None:
+        self._on_status_change = callback
+
+    def _publish_status(self) -> None:
+        self._status_snapshot = self._status.to_dict()
 
     def start(self) -> None:
         self._running = True
@@ -118,103 +239,43 @@ class PrinterService:
 
     def stop(self) -> None:
         self._running = False
+        self._report_event.set()
         with self._lock:
             if self._printer:
                 try:
                     self._printer.disconnect()
                 except Exception:
                     pass
-            self._status["connected"] = False
+            self._close_side_client()
+            self._status.connected = False
+            self._publish_status()
 
     def get_camera_url(self) -> Optional[str]:
-        if not self._config.camera_enabled:
-            return None
-        if self._config.camera_url:
-            return self._config.camera_url
-        protocol = self._config.camera_protocol
-        user = self._config.camera_user
-        path = self._config.camera_path
-        if not path.startswith("/"):
-            path = "/" + path
-        return (
-            f"{protocol}://{user}:{self._config.access_code}@"
-            f"{self._config.printer_ip}:{self._config.camera_port}{path}"
-        )
+        return self._config.camera_url if self._config.camera_enabled else None
 
     def test_connection(self, force: bool = True) -> Dict[str, Any]:
         with self._lock:
             ok = self._ensure_connected(force=force)
-            if ok and self._printer:
+            if ok and self._running:
+                # The poll loop refreshes (and publishes) on its next wakeup.
+                self._report_event.set()
+            elif ok and self._printer:
                 try:
-                    self._status["printer_state"] = self._printer.get_state()
-                    status = self._printer.get_current_state()
-                    self._status["print_status"] = str(status)
-                    self._status["filament_runout"] = (
-                        status == PrintStatus.PAUSED_FILAMENT_RUNOUT
-                    )
-                    self._status["sequence_id"] = self._get_sequence_id()
-                    try:
-                        self._status["print_error_code"] = int(
-                            self._printer.print_error_code()
-                        )
-                    except Exception:
-                        self._status["print_error_code"] = None
-
-                    # Capture fault detail directly from the MQTT dump (local state),
-                    # since some fields are not always parseable as ints.
-                    try:
-                        dump = self._printer.mqtt_dump()
-                        print_section = dump.get("print", {}) if isinstance(dump, dict) else {}
-                        if isinstance(print_section, dict):
-                            self._status["print_error_raw"] = print_section.get("print_error")
-                            self._status["fail_reason"] = print_section.get("fail_reason")
-                            self._status["mc_print_error_code"] = print_section.get(
-                                "mc_print_error_code"
-                            )
-                            hms = print_section.get("hms")
-                            if isinstance(hms, list):
-                                self._status["hms"] = hms[:10]
-                            else:
-                                self._status["hms"] = hms
-                    except Exception:
-                        self._status["print_error_raw"] = None
-                        self._status["fail_reason"] = None
-                        self._status["mc_print_error_code"] = None
-                        self._status["hms"] = None
-
-                    if self._status.get("print_error_code") is None:
-                        raw = self._status.get("print_error_raw")
-                        try:
-                            if raw is not None:
-                                self._status["print_error_code"] = int(raw)
-                        except Exception:
-                            pass
-                    try:
-                        self._status["gcode_file"] = self._printer.gcode_file()
-                    except Exception:
-                        self._status["gcode_file"] = None
-                    try:
-                        self._status["subtask_name"] = self._printer.subtask_name()
-                    except Exception:
-                        self._status["subtask_name"] = None
-                    self._status["percentage"] = self._printer.get_percentage()
-                    self._status["bed_temp"] = self._printer.get_bed_temperature()
-                    self._status["nozzle_temp"] = self._printer.get_nozzle_temperature()
-                    self._status["remaining_time"] = self._printer.get_time()
-                    self._status["light_state"] = self._printer.get_light_state()
-                    self._status["last_update"] = time.time()
+                    self._read_report()
                 except Exception:
                     # Leave existing status fields as-is; the connection itself is
                     # still considered ok.
                     pass
+            self._publish_status()
             return {
                 "ok": ok,
-                "last_error": self._status.get("last_error"),
-                "connected": self._status.get("connected"),
+                "last_error": self._status.last_error,
+                "connected": self._status.connected,
             }
 
     def _ensure_connected(self, force: bool = False) -> bool:
-        now = time.time()
+        # Monotonic: a wall-clock step must not stretch or skip the backoff.
+        now = time.monotonic()
         if not force and now < self._next_connect_time:
             return False
         if self._printer is None:
@@ -223,7 +284,13 @@ class PrinterService:
                 self._config.access_code,
                 self._config.serial,
             )
-        if not self._status["connected"]:
+            self._printer.mqtt_client.on_message_handler = self._on_report
+            # Every bambulabs_api command (pushall, the getters' periodic
+            # _update, gcode, lights, start_print, ...) funnels through its
+            # private __publish_command, whose wait_for_publish() has no
+            # timeout and would hang us under _lock on a stalled broker.
+            self._printer.mqtt_client._PrinterMQTTClient__publish_command = self._publish_library_command
+        if not self._status.connected:
             try:
                 # We only need MQTT for status + control; the dashboard handles
                 # camera streaming separately via ffmpeg.
@@ -242,83 +309,105 @@ class PrinterService:
                     raise RuntimeError("MQTT connection not ready")
                 try:
                     self._printer.mqtt_client.pushall()
-                except Exception:
+                except _PUBLISH_ERRORS:
                     pass
-                self._status["connected"] = True
-                self._status["last_error"] = None
+                self._status.connected = True
+                self._status.last_error = None
+                self._publish_status()
                 self._backoff_sec = 2.0
                 self._next_connect_time = 0.0
             except Exception as exc:  # noqa: BLE001
-                self._status["last_error"] = str(exc)
-                self._status["connected"] = False
+                self._status.last_error = str(exc)
+                self._status.connected = False
+                self._publish_status()
                 self._next_connect_time = now + self._backoff_sec
                 self._backoff_sec = min(self._backoff_sec * 2, 60.0)
                 return False
         return True
 
+    def _on_report(self, *_args: Any) -> None:
+        # Runs on paho's network thread: never take self._lock here, commands
+        # holding it wait on this thread to deliver state updates.
+        self._last_report_at = time.monotonic()
+        self._report_event.set()
+        self._state_event.set()
+
     def _poll_loop(self) -> None:
         while self._running:
+            started = time.monotonic()
+            self._report_event.clear()
             with self._lock:
-                if not self._ensure_connected():
-                    time.sleep(self._poll_interval_sec)
-                    continue
+                before = (self._status.connected, self._status.printer_state)
+                self._poll_once()
+                self._publish_status()
+                changed = before != (self._status.connected, self._status.printer_state)
+            callback = self._on_status_change
+            if changed and callback:
                 try:
-                    self._status["printer_state"] = self._printer.get_state()
-                    status = self._printer.get_current_state()
-                    self._status["print_status"] = str(status)
-                    self._status["filament_runout"] = (
-                        status == PrintStatus.PAUSED_FILAMENT_RUNOUT
-                    )
-                    self._status["sequence_id"] = self._get_sequence_id()
-                    try:
-                        self._status["print_error_code"] = int(
-                            self._printer.print_error_code()
-                        )
-                    except Exception:
-                        self._status["print_error_code"] = None
-
-                    try:
-                        dump = self._printer.mqtt_dump()
-                        print_section = dump.get("print", {}) if isinstance(dump, dict) else {}
-                        if isinstance(print_section, dict):
-                            self._status["print_error_raw"] = print_section.get("print_error")
-                            self._status["fail_reason"] = print_section.get("fail_reason")
-                            self._status["mc_print_error_code"] = print_section.get(
-                                "mc_print_error_code"
-                            )
-                            hms = print_section.get("hms")
-                            if isinstance(hms, list):
-                                self._status["hms"] = hms[:10]
-                            else:
-                                self._status["hms"] = hms
-                    except Exception:
-                        self._status["print_error_raw"] = None
-                        self._status["fail_reason"] = None
-                        self._status["mc_print_error_code"] = None
-                        self._status["hms"] = None
-
-                    if self._status.get("print_error_code") is None:
-                        raw = self._status.get("print_error_raw")
-                        try:
-                            if raw is not None:
-                                self._status["print_error_code"] = int(raw)
-                        except Exception:
-                            pass
-                    self._status["percentage"] = self._printer.get_percentage()
-                    self._status["bed_temp"] = self._printer.get_bed_temperature()
-                    self._status["nozzle_temp"] = self._printer.get_nozzle_temperature()
-                    self._status["remaining_time"] = self._printer.get_time()
-                    self._status["light_state"] = self._printer.get_light_state()
-                    self._status["last_error"] = None
-                    self._status["last_update"] = time.time()
-                except Exception as exc:  # noqa: BLE001
-                    self._status["last_error"] = str(exc)
-                    self._status["connected"] = False
-            time.sleep(self._poll_interval_sec)
+                    callback()
+                except Exception:
+                    pass
+            # poll_interval_sec is now the fallback when the printer is quiet.
+            self._report_event.wait(self._poll_interval_sec)
+            remaining = MIN_REFRESH_INTERVAL_SEC - (time.monotonic() - started)
+            if remaining > 0 and self._running:
+                time.sleep(remaining)
+
+    def _poll_once(self) -> None:
+        if not self._ensure_connected():
+            return
+        try:
+            self._read_report()
+            self._status.last_error = None
+        except Exception as exc:  # noqa: BLE001
+            self._status.last_error = str(exc)
+            self._status.connected = False
+
+    def _read_report(self) -> None:
+        # One pass over the printer's cached MQTT report. The bambulabs_api
+        # getters each re-walk the same dict; the conversions below match them.
+        try:
+            # The getters' throttled periodic pushall.
+            self._printer.mqtt_client._update()
+        except _PUBLISH_ERRORS:
+            pass
+        dump = self._printer.mqtt_dump()
+        try:
+            get = dump["print"].get
+        except (KeyError, TypeError, AttributeError):
+            # No report yet, or a malformed one: read everything as missing.
+            get = {}.get
+        status = self._status
+        status.printer_state = GcodeState(get("gcode_state", -1))
+        current = PrintStatus(get("stg_cur", -1))
+        status.print_status = str(current)
+        status.filament_runout = current == PrintStatus.PAUSED_FILAMENT_RUNOUT
+        try:
+            status.sequence_id = int(get("sequence_id", 0))
+        except (TypeError, ValueError):
+            status.sequence_id = None
+        status.print_error_raw = get("print_error")
+        try:
+            status.print_error_code = int(get("print_error", 0))
+        except (TypeError, ValueError):
+            status.print_error_code = None
+        status.fail_reason = get("fail_reason")
+        status.mc_print_error_code = get("mc_print_error_code")
+        hms = get("hms")
+        status.hms = hms[:10] if isinstance(hms, list) else hms
+        status.gcode_file = get("gcode_file")
+        status.subtask_name = get("subtask_name")
+        status.percentage = get("mc_percent")
+        status.bed_temp = float(get("bed_temper", 0.0))
+        status.nozzle_temp = float(get("nozzle_temper", 0.0))
+        status.remaining_time = get("mc_remaining_time")
+        lights = get("lights_report") or []
+        status.light_state = lights[0].get("mode", "unknown") if lights else "unknown"
+        status.last_update = time.time()
 
     def get_status(self) -> Dict[str, Any]:
-        with self._lock:
-            return dict(self._status)
+        # Shared snapshot: callers must copy before modifying it.
+        return self._status_snapshot
 
     def get_mqtt_dump(self) -> Dict[str, Any]:
         with self._lock:
@@ -333,15 +422,16 @@ class PrinterService:
             # Ask for a fresh state to populate AMS details
             try:
                 self._printer.mqtt_client.pushall()
-            except Exception:
+            except _PUBLISH_ERRORS:
                 pass
             time.sleep(0.2)
             hub = self._printer.ams_hub()
-            ams_list: list[dict[str, Any]] = []
-            for ams_id, ams in hub.ams_hub.items():
-                trays = []
-                for tray_id, tray in ams.filament_trays.items():
-                    trays.append(
+            ams_list: list[dict[str, Any]] = [
+                {
+                    "ams_id": ams_id,
+                    "humidity": ams.humidity,
+                    "temperature": ams.temperature,
+                    "trays": [
                         {
                             "tray_id": tray_id,
                             "tray_id_name": tray.tray_id_name,
@@ -354,15 +444,11 @@ class PrinterService:
                             "tray_weight": tray.tray_weight,
                             "tray_uuid": tray.tray_uuid,
                         }
-                    )
-                ams_list.append(
-                    {
-                        "ams_id": ams_id,
-                        "humidity": ams.humidity,
-                        "temperature": ams.temperature,
-                        "trays": trays,
-                    }
-                )
+                        for tray_id, tray in ams.filament_trays.items()
+                    ],
+                }
+                for ams_id, ams in hub.ams_hub.items()
+            ]
             if not ams_list or all(not unit.get("trays") for unit in ams_list):
                 raw = self._get_ams_raw()
                 if raw:
@@ -386,7 +472,7 @@ class PrinterService:
             return {
                 "ams": ams_list,
                 "external_tray": vt_tray,
-                "selected": self._status.get("selected_ams"),
+                "selected": self._status.selected_ams,
             }
 
     def select_ams_tray(self, ams_id: int, tray_id: int) -> Dict[str, Any]:
@@ -395,8 +481,10 @@ class PrinterService:
                 raise RuntimeError("Printer not connected")
 
             tool_id = int(ams_id) * 4 + int(tray_id)
-            self._selected_ams = {"ams_id": int(ams_id), "tray_id": int(tray_id), "tool_id": tool_id}
-            self._status["selected_ams"] = dict(self._selected_ams)
+            # Immutable, so the same instance is shared with status snapshots and responses.
+            self._selected_ams = SelectedAms(int(ams_id), int(tray_id), tool_id)
+            self._status.selected_ams = self._selected_ams
+            self._publish_status()
 
             hub = self._printer.ams_hub()
             tray_info = None
@@ -412,29 +500,23 @@ class PrinterService:
                         "tray_color": tray.tray_color,
                     }
             if tray_info is None:
-                raw = self._get_ams_raw()
-                for unit in raw or []:
-                    if unit.get("ams_id") == ams_id:
-                        for t in unit.get("trays", []):
-                            if t.get("tray_id") == tray_id:
-                                tray_info = t
-                                break
+                self._get_ams_raw()
+                tray_info = self._ams_tray_index.get((ams_id, tray_id))
             if tray_info is None:
                 raise RuntimeError(f"Tray {tray_id} not found on AMS {ams_id}")
 
             # Always return the selection so the UI can reflect it even if the
             # printer isn't currently in a filament action.
-            color = (tray_info.get("tray_color") or "FFFFFF").lstrip("#")
-            if len(color) >= 6:
-                color = color[:6]
-            else:
-                color = color.ljust(6, "F")
-            settings = AMSFilamentSettings(
+            color = _normalize_color(tray_info.get("tray_color"))
+            settings_key = (
                 str(tray_info.get("tray_info_idx") or ""),
                 int(tray_info.get("nozzle_temp_min") or 0),
                 int(tray_info.get("nozzle_temp_max") or 0),
                 str(tray_info.get("tray_type") or ""),
             )
+            settings = self._filament_settings.get(settings_key)
+            if settings is None:
+                settings = self._filament_settings[settings_key] = AMSFilamentSettings(*settings_key)
             # set_filament_printer() is best-effort: some firmwares/models reject
             # it or require additional state. Selection should still be saved
             # locally and used for the next start_print() mapping.
@@ -466,13 +548,14 @@ class PrinterService:
                 resume_ok = bool(self._printer.retry_filament_action())
 
             return {
-                "selected": dict(self._selected_ams),
+                "selected": self._selected_ams,
                 "set": set_ok,
                 "toolchange": toolchange_ok,
                 "resume": resume_ok,
             }
 
     def _get_ams_raw(self) -> list[dict[str, Any]]:
+        self._ams_tray_index = {}
         try:
             dump = self._printer.mqtt_dump()
         except Exception:
@@ -484,6 +567,7 @@ class PrinterService:
             return []
         units = ams_info.get("ams", []) or []
         ams_list: list[dict[str, Any]] = []
+        index: dict[tuple[int, int], dict[str, Any]] = {}
         for unit in units:
             try:
                 ams_id = int(unit.get("id", 0))
@@ -500,20 +584,20 @@ class PrinterService:
                 if tray_info_idx in (None, "", "0") and tray_state in (0, "0", None):
                     # Empty slot with no info
                     continue
-                trays.append(
-                    {
-                        "tray_id": int(tray_id),
-                        "tray_id_name": tray.get("tray_id_name"),
-                        "tray_type": tray.get("tray_type"),
-                        "tray_color": tray.get("tray_color"),
-                        "tray_info_idx": tray.get("tray_info_idx"),
-                        "nozzle_temp_min": tray.get("nozzle_temp_min"),
-                        "nozzle_temp_max": tray.get("nozzle_temp_max"),
-                        "tray_temp": tray.get("tray_temp"),
-                        "tray_weight": tray.get("tray_weight"),
-                        "tray_uuid": tray.get("tray_uuid"),
-                    }
-                )
+                entry = {
+                    "tray_id": int(tray_id),
+                    "tray_id_name": tray.get("tray_id_name"),
+                    "tray_type": tray.get("tray_type"),
+                    "tray_color": tray.get("tray_color"),
+                    "tray_info_idx": tray.get("tray_info_idx"),
+                    "nozzle_temp_min": tray.get("nozzle_temp_min"),
+                    "nozzle_temp_max": tray.get("nozzle_temp_max"),
+                    "tray_temp": tray.get("tray_temp"),
+                    "tray_weight": tray.get("tray_weight"),
+                    "tray_uuid": tray.get("tray_uuid"),
+                }
+                trays.append(entry)
+                index[(ams_id, entry["tray_id"])] = entry
             ams_list.append(
                 {
                     "ams_id": ams_id,
@@ -522,6 +606,7 @@ class PrinterService:
                     "trays": trays,
                 }
             )
+        self._ams_tray_index = index
         return ams_list
 
     def _get_sequence_id(self) -> Optional[int]:
@@ -534,16 +619,18 @@ class PrinterService:
 
     def _wait_for_gcode_state(
         self,
-        targets: set[GcodeState],
+        targets: frozenset[GcodeState],
         timeout_sec: float = 8.0,
         poll_interval_sec: float = 0.25,
         pushall_interval_sec: float = 1.0,
     ) -> bool:
         if not self._printer:
             return False
-        deadline = time.time() + timeout_sec
-        last_pushall = 0.0
-        while time.time() < deadline:
+        deadline = time.monotonic() + timeout_sec
+        last_pushall = float("-inf")
+        while time.monotonic() < deadline:
+            # Clear before reading so a report landing in between still wakes us.
+            self._state_event.clear()
             try:
                 state = self._printer.get_state()
             except Exception:
@@ -551,14 +638,15 @@ class PrinterService:
             if state in targets:
                 return True
             # Nudge the printer to emit a fresh state snapshot (but don't spam it).
-            now = time.time()
+            now = time.monotonic()
             if now - last_pushall >= pushall_interval_sec:
                 last_pushall = now
                 try:
                     self._printer.mqtt_client.pushall()
-                except Exception:
+                except _PUBLISH_ERRORS:
                     pass
-            time.sleep(poll_interval_sec)
+            # Woken by the next MQTT report; poll_interval_sec is the fallback.
+            self._state_event.wait(min(poll_interval_sec, max(deadline - time.monotonic(), 0)))
         return False
 
     def pause(self) -> bool:
@@ -566,20 +654,15 @@ class PrinterService:
             if not self._ensure_connected(force=True):
                 return False
             state = self._printer.get_state()
-            if state == GcodeState.PAUSE:
+            if state is GcodeState.PAUSE:
                 return True
-            if state in (GcodeState.IDLE, GcodeState.FINISH, GcodeState.FAILED):
+            if state in _DONE_STATES:
                 # Not currently pausable.
                 return False
 
-            seq = self._get_sequence_id()
             # Fire a few variants quickly, then wait once for the state transition.
-            self._mqtt_print_command("pause")
-            if seq is not None:
-                self._mqtt_print_command("pause", sequence_id=str(seq))
-            self._mqtt_print_command("pause", sequence_id="0")
-            self._mqtt_print_command("pause", sequence_id="0", param="")
-            if self._wait_for_gcode_state({GcodeState.PAUSE}):
+            self._send_print_command_variants("pause")
+            if self._wait_for_gcode_state(_PAUSED_STATES):
                 return True
 
             # Fallback: try standard G-code pause (often ignored on Bambu firmware).
@@ -587,26 +670,21 @@ class PrinterService:
                 self._printer.gcode("M25", gcode_check=False)
             except Exception:
                 return False
-            return self._wait_for_gcode_state({GcodeState.PAUSE})
+            return self._wait_for_gcode_state(_PAUSED_STATES)
 
     def resume(self) -> bool:
         with self._lock:
             if not self._ensure_connected(force=True):
                 return False
             state = self._printer.get_state()
-            if state == GcodeState.RUNNING:
+            if state is GcodeState.RUNNING:
                 return True
-            if state != GcodeState.PAUSE:
+            if state is not GcodeState.PAUSE:
                 # Only resumable if we're actually paused.
                 return False
 
-            seq = self._get_sequence_id()
-            self._mqtt_print_command("resume")
-            if seq is not None:
-                self._mqtt_print_command("resume", sequence_id=str(seq))
-            self._mqtt_print_command("resume", sequence_id="0")
-            self._mqtt_print_command("resume", sequence_id="0", param="")
-            if self._wait_for_gcode_state({GcodeState.RUNNING}):
+            self._send_print_command_variants("resume")
+            if self._wait_for_gcode_state(_RUNNING_STATES):
                 return True
 
             # Filament-runout pause can require a different resume action.
@@ -614,7 +692,7 @@ class PrinterService:
                 self._printer.retry_filament_action()
             except Exception:
                 return False
-            if self._wait_for_gcode_state({GcodeState.RUNNING}):
+            if self._wait_for_gcode_state(_RUNNING_STATES):
                 return True
 
             # Fallback: try standard G-code resume.
@@ -622,28 +700,22 @@ class PrinterService:
                 self._printer.gcode("M24", gcode_check=False)
             except Exception:
                 return False
-            return self._wait_for_gcode_state({GcodeState.RUNNING})
+            return self._wait_for_gcode_state(_RUNNING_STATES)
 
     def stop_print(self) -> bool:
         with self._lock:
             if not self._ensure_connected(force=True):
                 return False
             state = self._printer.get_state()
-            if state in (GcodeState.IDLE, GcodeState.FINISH, GcodeState.FAILED):
+            if state in _DONE_STATES:
                 return True
 
-            expected = {GcodeState.IDLE, GcodeState.FINISH, GcodeState.FAILED}
-            seq = self._get_sequence_id()
-            self._mqtt_print_command("stop")
-            if seq is not None:
-                self._mqtt_print_command("stop", sequence_id=str(seq))
-            self._mqtt_print_command("stop", sequence_id="0")
-            self._mqtt_print_command("stop", sequence_id="0", param="")
-            if self._wait_for_gcode_state(expected):
+            self._send_print_command_variants("stop")
+            if self._wait_for_gcode_state(_DONE_STATES):
                 # Some firmwares latch FAILED after user stop/cancel even when there
                 # is no fault. Attempt a best-effort clear in that "soft failed" case.
                 try:
-                    if self._printer.get_state() == GcodeState.FAILED and self._is_soft_failed():
+                    if self._printer.get_state() is GcodeState.FAILED and self._is_soft_failed():
                         self.clear_failed_state()
                 except Exception:
                     pass
@@ -654,9 +726,9 @@ class PrinterService:
                 self._printer.gcode("M0", gcode_check=False)
             except Exception:
                 pass
-            if self._wait_for_gcode_state(expected):
+            if self._wait_for_gcode_state(_DONE_STATES):
                 try:
-                    if self._printer.get_state() == GcodeState.FAILED and self._is_soft_failed():
+                    if self._printer.get_state() is GcodeState.FAILED and self._is_soft_failed():
                         self.clear_failed_state()
                 except Exception:
                     pass
@@ -665,7 +737,7 @@ class PrinterService:
                 self._printer.gcode("M25", gcode_check=False)
             except Exception:
                 return False
-            return self._wait_for_gcode_state(expected)
+            return self._wait_for_gcode_state(_DONE_STATES)
 
     def _is_soft_failed(self) -> bool:
         """
@@ -685,12 +757,13 @@ class PrinterService:
             dump = self._printer.mqtt_dump()
             print_section = dump.get("print", {}) if isinstance(dump, dict) else {}
             if isinstance(print_section, dict):
-                mc = print_section.get("mc_print_error_code")
+                get = print_section.get
+                mc = get("mc_print_error_code")
                 try:
                     mc_ok = (mc is None) or int(mc) == 0
                 except Exception:
                     mc_ok = False
-                hms = print_section.get("hms")
+                hms = get("hms")
                 hms_ok = (hms is None) or (isinstance(hms, list) and len(hms) == 0)
         except Exception:
             mc_ok = False
@@ -712,7 +785,7 @@ class PrinterService:
                 return {"ok": False, "error": "Printer not connected"}
 
             before = self._printer.get_state()
-            if before != GcodeState.FAILED:
+            if before is not GcodeState.FAILED:
                 return {
                     "ok": True,
                     "skipped": "not_failed",
@@ -728,20 +801,15 @@ class PrinterService:
 
             # Send stop variants (same approach as stop_print) but wait for a
             # transition out of FAILED.
-            seq = self._get_sequence_id()
-            self._mqtt_print_command("stop")
-            if seq is not None:
-                self._mqtt_print_command("stop", sequence_id=str(seq))
-            self._mqtt_print_command("stop", sequence_id="0")
-            self._mqtt_print_command("stop", sequence_id="0", param="")
+            self._send_print_command_variants("stop")
 
             # Ask for a fresh state update after attempting a clear.
             try:
                 self._printer.mqtt_client.pushall()
-            except Exception:
+            except _PUBLISH_ERRORS:
                 pass
 
-            cleared = self._wait_for_gcode_state({GcodeState.IDLE, GcodeState.FINISH})
+            cleared = self._wait_for_gcode_state(_CLEARED_STATES)
             try:
                 after = self._printer.get_state()
             except Exception:
@@ -756,17 +824,17 @@ class PrinterService:
             except Exception:
                 soft_after = False
 
-            ok = bool(cleared) or (soft_before and soft_after and after == GcodeState.FAILED)
+            ok = bool(cleared) or (soft_before and soft_after and after is GcodeState.FAILED)
             return {
                 "ok": ok,
                 "before": str(before),
                 "after": str(after),
-                "soft_failed": bool(after == GcodeState.FAILED and soft_after),
+                "soft_failed": bool(after is GcodeState.FAILED and soft_after),
                 "note": (
                     "Printer still reports FAILED after stop/cancel; this is a firmware behavior. "
                     "If error codes are zero/empty, the printer is typically ready to start the next job. "
                     "You may still need to acknowledge the message on the printer panel."
-                    if after == GcodeState.FAILED and soft_after
+                    if after is GcodeState.FAILED and soft_after
                     else None
                 ),
             }
@@ -776,38 +844,58 @@ class PrinterService:
             if not self._ensure_connected(force=True):
                 return False
             ok = bool(self._printer.turn_light_on())
-            # Also try ledctrl for logo nodes to cover firmware differences
-            for node in ("logo_light", "logo", "logo_led", "led_logo"):
-                ok = self._mqtt_ledctrl("on", node=node) or ok
-            return ok
+            # Also try ledctrl for logo nodes to cover firmware differences.
+            # Unknown nodes are ignored silently, so all of them are sent.
+            payloads = [self._ledctrl_payload("on", node) for node in _LOGO_LED_NODES]
+            return self._publish_commands(payloads) or ok
 
     def light_off(self) -> bool:
         with self._lock:
             if not self._ensure_connected(force=True):
                 return False
             ok = bool(self._printer.turn_light_off())
-            # Also try ledctrl for logo nodes to cover firmware differences
-            for node in ("logo_light", "logo", "logo_led", "led_logo"):
-                ok = self._mqtt_ledctrl("off", node=node) or ok
-            return ok
+            # Also try ledctrl for logo nodes to cover firmware differences.
+            # Unknown nodes are ignored silently, so all of them are sent.
+            payloads = [self._ledctrl_payload("off", node) for node in _LOGO_LED_NODES]
+            return self._publish_commands(payloads) or ok
+
+    def _side_mqtt_client(self) -> mqtt.Client:
+        # Fallback publisher, connected once and reused: a TLS handshake per
+        # command is slow. paho's loop thread reconnects it if it drops.
+        with self._lock:
+            if self._side_client is None:
+                client = mqtt.Client()
+                client.username_pw_set("bblp", self._config.access_code)
+                client.tls_set(cert_reqs=ssl.CERT_NONE)
+                client.tls_insecure_set(True)
+                client.connect(self._config.printer_ip, 8883, 60)
+                client.loop_start()
+                self._side_client = client
+            return self._side_client
+
+    def _close_side_client(self) -> None:
+        client, self._side_client = self._side_client, None
+        if client is not None:
+            try:
+                client.disconnect()
+                client.loop_stop()
+            except Exception:
+                pass
 
     def _mqtt_publish(self, payload: dict) -> bool:
-        client = mqtt.Client()
-        client.username_pw_set("bblp", self._config.access_code)
-        client.tls_set(cert_reqs=ssl.CERT_NONE)
-        client.tls_insecure_set(True)
-        client.connect(self._config.printer_ip, 8883, 60)
-        client.loop_start()
+        client = self._side_mqtt_client()
         result = client.publish(
             f"device/{self._config.serial}/request",
-            json.dumps(payload),
+            orjson.dumps(payload),
             qos=0,
             retain=False,
         )
-        result.wait_for_publish()
-        client.loop_stop()
-        client.disconnect()
-        return result.is_published()
+        if _wait_published(result):
+            return True
+        # Timed out or not connected; drop the client so the next call starts fresh.
+        with self._lock:
+            self._close_side_client()
+        return False
 
     def _publish_command(self, payload: dict[str, Any]) -> bool:
         """
@@ -815,26 +903,15 @@ class PrinterService:
 
         Prefer the existing bambulabs_api MQTT session (when available) so commands
         go out over the same connection we're already using for status updates.
-        Fall back to a one-shot paho connection if needed.
+        Fall back to a persistent side paho connection if needed.
         """
-        if self._printer:
-            try:
-                publish = getattr(
-                    self._printer.mqtt_client,
-                    "_PrinterMQTTClient__publish_command",
-                    None,
-                )
-                if callable(publish) and bool(publish(payload)):
-                    return True
-            except Exception:
-                pass
-        try:
-            return bool(self._mqtt_publish(payload))
-        except Exception:
-            return False
+        return self._publish_commands([payload])
 
     def _mqtt_ledctrl(self, mode: str, node: str = "chamber_light") -> bool:
-        payload = {
+        return self._publish_command(self._ledctrl_payload(mode, node))
+
+    def _ledctrl_payload(self, mode: str, node: str) -> dict[str, Any]:
+        return {
             "system": {
                 "sequence_id": "0",
                 "command": "ledctrl",
@@ -846,30 +923,114 @@ class PrinterService:
                 "interval_time": 0,
             }
         }
-        return self._publish_command(payload)
 
-    def _mqtt_print_command(
+    def _print_command_payload(
         self,
         command: str,
         *,
         sequence_id: Optional[str] = None,
         param: Any = None,
-    ) -> bool:
+    ) -> dict[str, Any]:
         body: dict[str, Any] = {"command": command}
         if sequence_id is not None:
             body["sequence_id"] = str(sequence_id)
         if param is not None:
             body["param"] = param
-        payload = {"print": body}
-        return self._publish_command(payload)
+        return {"print": body}
+
+    def _send_print_command_variants(self, command: str) -> bool:
+        # Firmwares disagree on which sequence_id/param shape they accept, so
+        # send every variant and let the caller wait for the state change.
+        seq = self._get_sequence_id()
+        payloads = [self._print_command_payload(command)]
+        if seq is not None:
+            payloads.append(self._print_command_payload(command, sequence_id=str(seq)))
+        payloads.append(self._print_command_payload(command, sequence_id="0"))
+        payloads.append(self._print_command_payload(command, sequence_id="0", param=""))
+        return self._publish_commands(payloads)
+
+    def _publish_commands(self, payloads: List[dict[str, Any]]) -> bool:
+        """
+        Publish several commands back-to-back, then wait for all of them.
+
+        Goes out over the status session when it is up (see _publish_on_session)
+        and falls back to the side connection if nothing got through.
+        """
+        if self._publish_on_session(payloads):
+            return True
+        ok = False
+        for payload in payloads:
+            try:
+                ok = self._mqtt_publish(payload) or ok
+            except Exception:
+                pass
+        return ok
+
+    def _publish_on_session(self, payloads: List[dict[str, Any]]) -> bool:
+        """
+        Publish on the bambulabs_api session's paho client with bounded waits.
+
+        Messages are queued first so they go out together. bambulabs_api's own
+        publish helper waits forever, which would wedge the caller (and _lock)
+        on a stalled broker; _ensure_connected installs this in its place.
+        """
+        mqtt_client = self._printer.mqtt_client if self._printer else None
+        client = getattr(mqtt_client, "_client", None)
+        topic = getattr(mqtt_client, "command_topic", None)
+        if client is None or topic is None or not client.is_connected():
+            return False
+        try:
+            infos = [client.publish(topic, orjson.dumps(payload)) for payload in payloads]
+        except _PUBLISH_ERRORS:
+            return False
+        results = [_wait_published(info) for info in infos]
+        return any(results)
+
+    def _publish_library_command(self, payload: dict[str, Any]) -> bool:
+        # Stand-in for PrinterMQTTClient.__publish_command: same payload and
+        # no side-connection fallback, but the wait is bounded.
+        return self._publish_on_session([payload])
 
     def chamber_light_on(self) -> bool:
-        with self._lock:
-            return self._mqtt_ledctrl("on", node="chamber_light")
+        return self._set_chamber_light("on")
 
     def chamber_light_off(self) -> bool:
+        return self._set_chamber_light("off")
+
+    def _set_chamber_light(self, mode: str) -> bool:
         with self._lock:
-            return self._mqtt_ledctrl("off", node="chamber_light")
+            if self._reported_chamber_light() == mode:
+                # The printer already reports this mode; skip the round trip.
+                return True
+            ok = self._mqtt_ledctrl(mode, node="chamber_light")
+            self._chamber_light_sent = (mode, time.monotonic())
+            return ok
+
+    def _reported_chamber_light(self) -> Optional[str]:
+        # Only trust a live session's report from the last couple of polls.
+        reported_at = self._last_report_at
+        if not self._status.connected or self._printer is None or reported_at is None:
+            return None
+        if time.monotonic() - reported_at > 2 * self._poll_interval_sec:
+            return None
+        sent = self._chamber_light_sent
+        if sent is not None:
+            # After our own ledctrl the cached lights_report may still show the
+            # old mode (reports are partial), so only the mode we last sent can
+            # be confirmed, and only by a report that arrived after it.
+            sent_mode, sent_at = sent
+            if reported_at <= sent_at:
+                return None
+        try:
+            for light in self._printer.mqtt_dump()["print"]["lights_report"]:
+                if light.get("node") == "chamber_light":
+                    mode = light.get("mode")
+                    if sent is not None and mode != sent_mode:
+                        return None
+                    return mode
+        except (KeyError, TypeError, AttributeError):
+            pass
+        return None
 
     def jog(self, dx: float, dy: float, dz: float, feed: int) -> bool:
         with self._lock:
@@ -904,78 +1065,83 @@ class PrinterService:
         """
         Set fan speeds as percentages (0-100).
 
-        Uses the bambulabs_api helpers, which send M106 commands over MQTT:
+        All requested fans go out as one gcode_line publish carrying the same
+        newline-terminated M106 lines the bambulabs_api fan helpers send:
         - part fan: M106 P1 Sxxx
         - aux fan:  M106 P2 Sxxx
         - chamber:  M106 P3 Sxxx
         """
-
-        def clamp_percent(value: int) -> int:
-            return max(0, min(100, int(value)))
-
-        def percent_to_pwm(percent: int) -> int:
-            return int(round(255 * (percent / 100.0)))
-
+        fans = {
+            name: (index, max(0, min(100, int(value))))
+            for name, index, value in (
+                ("part", 1, part_percent),
+                ("aux", 2, aux_percent),
+                ("chamber", 3, chamber_percent),
+            )
+            if value is not None
+        }
         results: Dict[str, bool] = {}
         with self._lock:
             if not self._ensure_connected(force=True):
                 return {"connected": False}
-
-            if part_percent is not None:
-                p = clamp_percent(part_percent)
-                results["part"] = bool(self._printer.set_part_fan_speed(percent_to_pwm(p)))
-                if results["part"]:
-                    self._status["part_fan_percent"] = p
-
-            if aux_percent is not None:
-                p = clamp_percent(aux_percent)
-                results["aux"] = bool(self._printer.set_aux_fan_speed(percent_to_pwm(p)))
-                if results["aux"]:
-                    self._status["aux_fan_percent"] = p
-
-            if chamber_percent is not None:
-                p = clamp_percent(chamber_percent)
-                results["chamber"] = bool(self._printer.set_chamber_fan_speed(percent_to_pwm(p)))
-                if results["chamber"]:
-                    self._status["chamber_fan_percent"] = p
+            if not fans:
+                return results
+
+            gcode = "".join(f"M106 P{index} S{_PCT_TO_PWM[p]}\n" for index, p in fans.values())
+            payload = {"print": {"sequence_id": "0", "command": "gcode_line", "param": gcode}}
+            ok = self._publish_commands([payload])
+            results = dict.fromkeys(fans, ok)
+            if ok:
+                status = self._status
+                if "part" in fans:
+                    status.part_fan_percent = fans["part"][1]
+                if "aux" in fans:
+                    status.aux_fan_percent = fans["aux"][1]
+                if "chamber" in fans:
+                    status.chamber_fan_percent = fans["chamber"][1]
+            self._publish_status()
 
         return results
 
     def upload_file(self, filename: str, data: bytes) -> str:
+        # BytesIO shares the bytes buffer (no copy) and the FTP client streams
+        # it in blocks, so there is nothing to gain from spooling to disk.
+        return self.upload_file_obj(BytesIO(data), filename)
+
+    def _printer_for_upload(self) -> bl.Printer:
         with self._lock:
             if not self._ensure_connected(force=True):
                 raise RuntimeError("Printer not connected")
-            bio = BytesIO(data)
-            bio.seek(0)
-            return self._printer.upload_file(bio, filename)
+            return self._printer
 
     def upload_file_obj(self, fileobj, filename: str) -> str:
-        with self._lock:
-            if not self._ensure_connected(force=True):
-                raise RuntimeError("Printer not connected")
+        printer = self._printer_for_upload()
+        with self._upload_lock:
             if hasattr(fileobj, "seek"):
                 try:
-                    fileobj.seek(0)
+                    # Callers usually rewind already; seeking a spooled or
+                    # buffered file can flush it, so only seek when needed.
+                    if fileobj.tell():
+                        fileobj.seek(0)
                 except OSError:
                     pass
-            return self._printer.upload_file(fileobj, filename)
+            return printer.upload_file(fileobj, filename)
 
     def upload_file_path(self, filepath: str, filename: str) -> str:
-        with self._lock:
-            if not self._ensure_connected(force=True):
-                raise RuntimeError("Printer not connected")
-            with open(filepath, "rb") as handle:
-                return self._printer.upload_file(handle, filename)
+        printer = self._printer_for_upload()
+        with self._upload_lock, open(filepath, "rb") as handle:
+            return printer.upload_file(handle, filename)
 
     def start_print(self, filename: str, plate: int = 1) -> bool:
         with self._lock:
             if not self._ensure_connected(force=True):
                 return False
             ams_mapping = [0]
-            if self._selected_ams and "tool_id" in self._selected_ams:
+            if self._selected_ams is not None:
                 # Single-color override: map extruder 0 to the selected AMS slot.
-                ams_mapping = [int(self._selected_ams["tool_id"])]
-            self._status["last_start_ams_mapping"] = list(ams_mapping)
+                ams_mapping = [self._selected_ams.tool_id]
+            self._status.last_start_ams_mapping = list(ams_mapping)
+            self._publish_status()
             return bool(self._printer.start_print(filename, plate, ams_mapping=ams_mapping))
 
 
@@ -995,9 +1161,16 @@ class PrinterManager:
         for service in self._services.values():
             service.stop()
 
+    def set_status_callback(self, callback: Optional[Callable[[], None]]) -> None:
+        for service in self._services.values():
+            service.set_status_callback(callback)
+
     def list_printers(self) -> List[Dict[str, Any]]:
         return [service.get_status() for service in self._services.values()]
 
+    def list_services(self) -> Dict[str, PrinterService]:
+        return dict(self._services)
+
     def get_service(self, printer_id: str) -> PrinterService:
         if printer_id not in self._services:
             raise KeyError(f"Unknown printer_id: {printer_id}")
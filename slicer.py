@@ -4,15 +4,25 @@ import json
 import os
 import platform
 import shutil
+import signal
+import string
 import subprocess
 import tempfile
+import threading
+import time
 import zipfile
 import re
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
-PLATE_GCODE_RE = re.compile(r"^Metadata[\\/]plate_\\d+\\.gcode$", re.IGNORECASE)
+_HERE = Path(__file__).resolve().parent
+# Lines of slicer output kept for the error message on failure.
+SLICER_LOG_TAIL_LINES = 12
+
+PLATE_GCODE_RE = re.compile(r"^Metadata[\\/]plate_\d+\.gcode$", re.IGNORECASE)
 
 
 @dataclass
@@ -23,6 +33,36 @@ class SlicerConfig:
     orca_paths: List[str]
     bambu_paths: List[str]
     max_wait_sec: int
+    # Scheduling for the slicer process so slicing doesn't starve the MQTT
+    # pollers: niceness (0 = unchanged) and allowed CPUs (empty = any).
+    nice: int = 10
+    cpu_affinity: List[int] = field(default_factory=list)
+    # Last path resolve_slicer_exe() found; re-checked before reuse.
+    _resolved_exe: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+    _compiled_args: List[Callable[[Dict[str, str]], str]] = field(
+        default_factory=list, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        self._compiled_args = [_compile_arg(item) for item in self.command_args]
+
+
+def _compile_arg(item: str) -> Callable[[Dict[str, str]], str]:
+    # Parse each command_args template once: plain args become constants and
+    # a bare "{name}" a dict lookup; anything fancier keeps str.format.
+    try:
+        parsed = list(string.Formatter().parse(item))
+    except ValueError:
+        # Malformed template: let build_command raise the error as before.
+        return item.format_map
+    if all(name is None for _, name, _, _ in parsed):
+        literal = "".join(text for text, _, _, _ in parsed)
+        return lambda ctx: literal
+    if len(parsed) == 1:
+        text, name, spec, conversion = parsed[0]
+        if not text and name.isidentifier() and not spec and not conversion:
+            return lambda ctx: ctx[name]
+    return item.format_map
 
 
 def load_slicer_config(path: str = "config.json") -> SlicerConfig:
@@ -44,6 +84,8 @@ def load_slicer_config(path: str = "config.json") -> SlicerConfig:
     orca_paths = slicer.get("orca_paths") or []
     bambu_paths = slicer.get("bambu_paths") or []
     max_wait_sec = int(slicer.get("max_wait_sec", 600))
+    nice = int(slicer.get("nice", 10))
+    cpu_affinity = [int(cpu) for cpu in slicer.get("cpu_affinity") or []]
     return SlicerConfig(
         enabled=enabled,
         preferred=preferred,
@@ -51,12 +93,16 @@ def load_slicer_config(path: str = "config.json") -> SlicerConfig:
         orca_paths=orca_paths,
         bambu_paths=bambu_paths,
         max_wait_sec=max_wait_sec,
+        nice=nice,
+        cpu_affinity=cpu_affinity,
     )
 
 
+@lru_cache(maxsize=1)
 def _default_paths() -> Tuple[List[str], List[str]]:
+    # Cached: callers must not mutate the returned lists.
     system = platform.system().lower()
-    here = Path(__file__).resolve().parent
+    here = _HERE
     orca = []
     bambu = []
     if system == "windows":
@@ -105,9 +151,18 @@ def _first_existing(paths: List[str]) -> Optional[str]:
 
 
 def resolve_slicer_exe(config: SlicerConfig) -> Optional[str]:
+    cached = config._resolved_exe
+    if cached and os.path.exists(cached):
+        return cached
+    config._resolved_exe = _resolve_slicer_exe(config)
+    return config._resolved_exe
+
+
+def _resolve_slicer_exe(config: SlicerConfig) -> Optional[str]:
     orca_default, bambu_default = _default_paths()
-    orca_paths = config.orca_paths + orca_default
-    bambu_paths = config.bambu_paths + bambu_default
+    # PATH lookups go last so the configured and bundled slicers still win.
+    orca_paths = [*config.orca_paths, *orca_default, shutil.which("orca-slicer")]
+    bambu_paths = [*config.bambu_paths, *bambu_default, shutil.which("bambu-studio")]
 
     if config.preferred == "orca":
         return _first_existing(orca_paths)
@@ -118,19 +173,89 @@ def resolve_slicer_exe(config: SlicerConfig) -> Optional[str]:
     return _first_existing(orca_paths) or _first_existing(bambu_paths)
 
 
-def build_command(config: SlicerConfig, exe: str, input_path: str, output_path: str) -> List[str]:
-    args = []
-    for item in config.command_args:
-        args.append(
-            item.format(
-                exe=exe,
-                input=input_path,
-                output=output_path,
-                outdir=str(Path(output_path).parent),
-                base=Path(output_path).stem,
+def build_command(
+    config: SlicerConfig, exe: str, input_path: str, output_path: str, write_path: Optional[str] = None
+) -> List[str]:
+    # {outdir} and {base} always describe the final output; write_path only
+    # redirects {output}, so templates see the same names with or without staging.
+    output = Path(output_path)
+    ctx = {
+        "exe": exe,
+        "input": input_path,
+        "output": write_path or output_path,
+        "outdir": str(output.parent),
+        "base": output.stem,
+    }
+    return [arg(ctx) for arg in config._compiled_args]
+
+
+def _scheduling(config: SlicerConfig) -> Tuple[List[str], int]:
+    # Returns (command prefix, Popen creationflags). Wrapping the command in
+    # nice/taskset avoids preexec_fn, which is unsafe in a threaded server.
+    if platform.system().lower() == "windows":
+        flags = subprocess.BELOW_NORMAL_PRIORITY_CLASS if config.nice > 0 else 0
+        return [], flags
+    prefix: List[str] = []
+    if config.cpu_affinity and shutil.which("taskset"):
+        prefix += ["taskset", "-c", ",".join(str(cpu) for cpu in config.cpu_affinity)]
+    if config.nice and shutil.which("nice"):
+        prefix += ["nice", "-n", str(config.nice)]
+    return prefix, 0
+
+
+def _kill_tree(proc: subprocess.Popen) -> None:
+    # Slicers spawn workers; killing only the direct child would orphan them.
+    try:
+        if platform.system().lower() == "windows":
+            subprocess.run(
+                ["taskkill", "/F", "/T", "/PID", str(proc.pid)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
             )
-        )
-    return args
+        else:
+            # start_new_session made the slicer its own process group leader.
+            os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    proc.kill()
+    proc.wait()
+
+
+def _run_slicer(cmd: List[str], timeout: float, creationflags: int = 0) -> Tuple[int, str]:
+    # Slicers can log tens of MB; keep only the tail instead of buffering it
+    # all like capture_output would. stderr is merged since either stream
+    # may carry the error.
+    windows = platform.system().lower() == "windows"
+    if windows:
+        creationflags |= subprocess.CREATE_NEW_PROCESS_GROUP
+    proc = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace",
+        creationflags=creationflags,
+        start_new_session=not windows,
+    )
+    tail: deque[str] = deque(maxlen=SLICER_LOG_TAIL_LINES)
+    reader = threading.Thread(target=tail.extend, args=(proc.stdout,), daemon=True)
+    reader.start()
+    try:
+        returncode = proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill_tree(proc)
+        raise
+    finally:
+        reader.join(timeout=1.0)
+        if reader.is_alive():
+            # Workers that outlived the slicer still hold the pipe open; end
+            # them so the reader sees EOF. Closing the stream while the reader
+            # is blocked in read() would block on its buffer lock instead.
+            _kill_tree(proc)
+            reader.join(timeout=1.0)
+        if not reader.is_alive():
+            proc.stdout.close()
+    return returncode, "\n".join(line.rstrip("\r\n") for line in tail)
 
 
 def auto_slice(config: SlicerConfig, input_path: str, output_dir: str) -> str:
@@ -143,43 +268,64 @@ def auto_slice(config: SlicerConfig, input_path: str, output_dir: str) -> str:
     os.makedirs(output_dir, exist_ok=True)
     base = Path(input_path).stem
     output_path = str(Path(output_dir) / f"{base}.gcode.3mf")
-    cmd = build_command(config, exe, input_path, output_path)
+    # The slicer writes a staging file that is renamed into place once it
+    # checks out, so readers of output_path never see a partial 3MF. Keep
+    # the extension: slicers may append or check it.
+    staging_path = str(Path(output_dir) / f"{base}.part.gcode.3mf")
+    if os.path.exists(staging_path):
+        # Left behind by an aborted run; must not pass for this run's output.
+        os.remove(staging_path)
+    prefix, creationflags = _scheduling(config)
+    cmd = prefix + build_command(config, exe, input_path, output_path, staging_path)
+    # Coarse filesystem timestamps can land just before the run started.
+    started = time.time() - 2.0
 
     try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=config.max_wait_sec,
-        )
+        returncode, log_tail = _run_slicer(cmd, config.max_wait_sec, creationflags)
     except FileNotFoundError as exc:
         raise RuntimeError(f"Slicer not found: {exe}") from exc
     except subprocess.TimeoutExpired as exc:
         raise RuntimeError("Slicer timed out") from exc
 
-    if result.returncode != 0:
-        tail = (result.stderr or result.stdout or "").splitlines()[-12:]
-        raise RuntimeError("Slicer failed: " + "\n".join(tail))
-
-    if not os.path.exists(output_path):
-        # Some slicers write to input dir; try to detect.
-        candidates = list(Path(output_dir).glob("*.gcode.3mf"))
-        if candidates:
-            return str(candidates[0])
-        raise RuntimeError("Slicer reported success but output file not found.")
+    if prefix and returncode in (126, 127):
+        # nice/taskset report a missing or non-executable command through
+        # these exit codes instead of the FileNotFoundError Popen would raise.
+        raise RuntimeError(f"Slicer not found: {exe}")
+    if returncode != 0:
+        raise RuntimeError("Slicer failed: " + log_tail)
 
-    # Sanity-check: for Bambu-style 3MF output, we must have plate_N.gcode inside.
-    lower = output_path.lower()
-    if lower.endswith(".3mf"):
-        try:
-            with zipfile.ZipFile(output_path) as zf:
-                if not any(PLATE_GCODE_RE.match(name) for name in zf.namelist()):
-                    raise RuntimeError(
-                        "Slicer produced a .3mf without Metadata/plate_N.gcode. "
-                        "Make sure the slicer actually sliced (not just exported a project)."
-                    )
-        except zipfile.BadZipFile:
-            # Not a zip; treat as a normal file.
-            pass
+    if not os.path.exists(staging_path):
+        # Custom templates may write {outdir}/{base}.3mf themselves, and some
+        # slicers pick their own name; only accept files written by this run.
+        candidates = [
+            path
+            for path in Path(output_dir).glob("*.gcode.3mf")
+            if ".part." not in path.name and path.stat().st_mtime >= started
+        ]
+        if not candidates:
+            raise RuntimeError("Slicer reported success but output file not found.")
+        found = str(max(candidates, key=lambda path: path.stat().st_mtime))
+        _check_sliced_output(found)
+        return found
 
+    _check_sliced_output(staging_path)
+    os.replace(staging_path, output_path)
     return output_path
+
+
+def _check_sliced_output(path: str) -> None:
+    # Sanity-check: for Bambu-style 3MF output, we must have plate_N.gcode inside.
+    if not path.lower().endswith(".3mf"):
+        return
+    try:
+        with zipfile.ZipFile(path) as zf:
+            # infolist() is the parsed directory itself; namelist() would
+            # first copy out every name before any() can stop early.
+            if not any(PLATE_GCODE_RE.match(info.filename) for info in zf.infolist()):
+                raise RuntimeError(
+                    "Slicer produced a .3mf without Metadata/plate_N.gcode. "
+                    "Make sure the slicer actually sliced (not just exported a project)."
+                )
+    except zipfile.BadZipFile:
+        # Not a zip; treat as a normal file.
+        pass